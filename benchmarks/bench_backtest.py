@@ -0,0 +1,286 @@
+import sys
+import glob
+import json
+import math
+import zlib
+import argparse
+import numpy as np
+import pandas as pd
+import ffn
+import ffn.utils as utils
+import handleAPI.backtester as hBt
+import handleAPI.metrics as metrics
+import handleAPI.pricestore as pricestore
+import handleAPI.serialize as serialize
+import handleAPI.timing as timing
+
+# Backtest benchmark suite.
+#
+# Times calc_backtest() + serialize.encode() per stage (see
+# handleAPI/timing.py) on deterministic synthetic prices, with no network,
+# while scaling the number of portfolios, tickers and years. Run it from the
+# repository root:
+#   python -m benchmarks.bench_backtest                        all cases
+#   python -m benchmarks.bench_backtest --save bench.json      record a baseline
+#   python -m benchmarks.bench_backtest --baseline bench.json  fail on regressions
+#   python -m benchmarks.bench_backtest --prices ./PriceFiles  add the golden check
+#
+# Correctness checks run before the timings:
+#   - reference: on synthetic prices, the vector engine must reproduce the
+#     bt engine's results, and handleAPI/metrics.py must reproduce
+#     ffn.calc_stats() for every metric of data/metric_info.json, on both
+#     the asset prices and the bt strategy prices
+#   - golden: data/portfolios.json over the date range of each
+#     data/expected_results_*.json must reproduce that file. This needs the
+#     real prices of its tickers as <ticker_key>.csv files (the
+#     pricestore.FileSource layout). Those are not part of the repository,
+#     so this check is manual only: it runs with --prices and is skipped
+#     otherwise.
+# Exits with 1 when a check fails or a case is slower than in the baseline
+# by more than --threshold.
+
+STAGES = ['download', 'build', 'run', 'metrics', 'drawdowns', 'corr', 'serialize']
+
+END_DATE = '2024-01-01'
+# (portfolios, tickers, years); the first case is the size of
+# data/portfolios.json, the others scale one dimension at a time
+CASES = [
+    (3, 4, 3),
+    (10, 4, 3),
+    (30, 4, 3),
+    (3, 16, 3),
+    (3, 64, 3),
+    (3, 4, 10),
+    (3, 4, 20),
+    (30, 64, 20),
+]
+QUICK_CASES = CASES[:2]
+
+# Differences below this are noise, whatever the relative change
+MIN_REGRESSION_SECONDS = 0.01
+# Golden files are rounded to 10 significant digits
+GOLDEN_RTOL = 1e-6
+REFERENCE_RTOL = 1e-8
+
+
+class SyntheticSource:
+    # Deterministic random-walk prices on business days. Every ticker has
+    # its own generator seeded from (seed, crc32(clean ticker)), so a
+    # ticker's prices do not depend on which other tickers are requested.
+
+    FIRST_DATE = '1990-01-01'
+    LAST_DATE = '2030-12-31'
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self._series = {}
+
+    def _generate(self, ticker):
+        rng = np.random.default_rng([self.seed, zlib.crc32(utils.clean_ticker(ticker).encode('utf8'))])
+        dates = pd.bdate_range(self.FIRST_DATE, self.LAST_DATE)
+        drift = rng.uniform(-0.02, 0.12) / 252
+        vol = rng.uniform(0.05, 0.40) / np.sqrt(252)
+        prices = 100.0 * np.exp(np.cumsum(rng.normal(drift, vol, len(dates))))
+        return pd.Series(prices, index=dates)
+
+    def fetch(self, ticker, start, end):
+        if ticker not in self._series:
+            self._series[ticker] = self._generate(ticker)
+        return pricestore.slice_range(self._series[ticker], start, end)
+
+
+def case_name(n_portfolios, n_tickers, years):
+    return f'{n_portfolios}p-{n_tickers}t-{years}y'
+
+
+def make_request(n_portfolios, n_tickers, years, seed=0):
+    # [start, end, portfolios] as posted to /api/portfolios
+    rng = np.random.default_rng([seed, n_portfolios, n_tickers, years])
+    tickers = [f'SYN{i:03d}' for i in range(n_tickers)]
+    portfolios = []
+    for i in range(n_portfolios):
+        weights = rng.dirichlet(np.ones(n_tickers))
+        portfolios.append({
+            'name': f'Portfolio #{i + 1}',
+            'assets': [{'ticker': t, 'allocation': round(float(w), 4)} for t, w in zip(tickers, weights)],
+        })
+    start = pd.Timestamp(END_DATE) - pd.DateOffset(years=years)
+    return [start.strftime('%Y-%m-%d'), END_DATE, portfolios]
+
+
+def to_split(frames):
+    # The JSON the API returns, decoded: {name: {'columns', 'index', 'data'}}
+    return json.loads(serialize.to_json(frames))
+
+
+def normalize(value):
+    # Older pandas wrote ISO dates with a 'Z' suffix
+    if isinstance(value, str) and value.endswith('Z') and 'T' in value:
+        return value[:-1]
+    return value
+
+
+def values_match(expected, actual, rtol):
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return math.isclose(expected, actual, rel_tol=rtol, abs_tol=rtol)
+    return normalize(expected) == normalize(actual)
+
+
+def compare_split(label, expected, actual, rtol):
+    # Differences between two to_split() results, as error messages.
+    # The 'labelCn' column of the golden files is not produced any more
+    # (see calc_backtest()), so columns missing from actual are only an
+    # error if they are not labelCn.
+    errors = []
+    for name, exp in expected.items():
+        act = actual.get(name)
+        if act is None:
+            errors.append(f'{label}: missing {name!r}')
+            continue
+        if [normalize(i) for i in exp['index']] != [normalize(i) for i in act['index']]:
+            errors.append(f'{label}: {name!r} index differs')
+            continue
+        for j, column in enumerate(exp['columns']):
+            if column not in act['columns']:
+                if column != 'labelCn':
+                    errors.append(f'{label}: {name!r} missing column {column!r}')
+                continue
+            k = act['columns'].index(column)
+            for row, exp_row, act_row in zip(exp['index'], exp['data'], act['data']):
+                if not values_match(exp_row[j], act_row[k], rtol):
+                    errors.append(f'{label}: {name!r}[{row!r}, {column!r}] expected {exp_row[j]!r}, got {act_row[k]!r}')
+                    break
+    for name in actual:
+        if name not in expected:
+            errors.append(f'{label}: unexpected {name!r}')
+    return errors
+
+
+def compare_stats(label, prices, rf):
+    # handleAPI/metrics.py against ffn.calc_stats(), as error messages
+    stats = ffn.calc_stats(prices)
+    stats.set_riskfree_rate(rf)
+    expected = stats.stats
+    actual = hBt.metric_registry.compute(metrics.MetricContext(prices, rf=rf), list(hBt.metric_info))
+    errors = []
+    for metric in hBt.metric_info:
+        if metric not in actual.index:
+            errors.append(f'{label}: metric {metric!r} not computed')
+            continue
+        for column in prices.columns:
+            exp, act = expected.loc[metric, column], actual.loc[metric, column]
+            if pd.isna(exp) and pd.isna(act):
+                continue
+            if not values_match(exp.item() if isinstance(exp, np.generic) else exp,
+                                act.item() if isinstance(act, np.generic) else act, REFERENCE_RTOL):
+                errors.append(f'{label}: {metric!r}[{column!r}] expected {exp!r}, got {act!r}')
+    return errors
+
+
+def check_reference(source):
+    start, end, portfolios = make_request(*CASES[0])
+    vector = hBt.calc_backtest(start, end, portfolios, 'vector', source)
+    reference = hBt.calc_backtest(start, end, portfolios, 'bt', source)
+    errors = compare_split('reference', to_split(reference), to_split(vector), REFERENCE_RTOL)
+
+    # The metrics on the prices calc_backtest() starts from, with its
+    # risk-free rate
+    portfolios = hBt.clean_portfolios(portfolios)
+    allocations = []
+    a_prices = hBt.download(start, end, portfolios, allocations, source)
+    p_prices = hBt.run_strategies(a_prices, portfolios, allocations, 'bt')
+    errors += compare_stats('ffn assets', a_prices, 0.01)
+    errors += compare_stats('ffn portfolios', p_prices, 0.01)
+    return errors
+
+
+def check_golden(prices_dir):
+    portfolios = hBt.load_json('data/portfolios.json')
+    source = pricestore.FileSource(prices_dir)
+    errors = []
+    for file in sorted(glob.glob('data/expected_results_*.json')):
+        expected = hBt.load_json(file)
+        # The first row is bt's dummy row, one day before the first date
+        dates = expected['port_perf_chart']['index']
+        start = pd.Timestamp(dates[1]).tz_localize(None)
+        end = pd.Timestamp(dates[-1]).tz_localize(None) + pd.Timedelta(days=1)
+        frames = hBt.calc_backtest(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), portfolios, source=source)
+        errors += compare_split(file, expected, to_split(frames), GOLDEN_RTOL)
+    return errors
+
+
+def run_case(source, request, engine_name, repeat):
+    # Best of `repeat` runs, as {stage: seconds}
+    best = None
+    for _ in range(repeat):
+        with timing.collect() as spans:
+            frames = hBt.calc_backtest(*request, engine_name, source)
+            serialize.encode(frames)
+        if best is None or spans.total() < best.total():
+            best = spans
+    return dict(best.items())
+
+
+def print_row(name, stages):
+    total = sum(stages.values())
+    cells = ''.join(f'{stages.get(s, 0.0) * 1000:>11.1f}' for s in STAGES)
+    print(f'{name:<14}{total * 1000:>11.1f}{cells}')
+
+
+def find_regressions(results, baseline, threshold):
+    errors = []
+    for name, stages in results.items():
+        if name not in baseline:
+            continue
+        total, base = sum(stages.values()), sum(baseline[name].values())
+        if total > base * (1 + threshold) and total - base > MIN_REGRESSION_SECONDS:
+            errors.append(f'{name}: {total * 1000:.1f} ms, baseline {base * 1000:.1f} ms '
+                          f'(+{(total / base - 1) * 100:.0f}%)')
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest benchmark suite')
+    parser.add_argument('--engine', default=hBt.BACKTEST_ENGINE, choices=['vector', 'bt'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='only the smallest cases')
+    parser.add_argument('--prices', help='directory of real price CSVs for the golden check')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown over the baseline (0.25 = 25%%)')
+    parser.add_argument('--save', help='write the results JSON here')
+    args = parser.parse_args(argv)
+
+    source = SyntheticSource(args.seed)
+    failures = check_reference(source)
+    print(f'reference check: {"FAILED" if failures else "ok"}')
+    if args.prices:
+        golden = check_golden(args.prices)
+        print(f'golden check: {"FAILED" if golden else "ok"}')
+        failures += golden
+    else:
+        print('golden check: skipped (no --prices)')
+
+    print(f'{"case (ms)":<14}{"total":>11}' + ''.join(f'{s:>11}' for s in STAGES))
+    results = {}
+    for case in (QUICK_CASES if args.quick else CASES):
+        name = case_name(*case)
+        results[name] = run_case(source, make_request(*case, seed=args.seed), args.engine, args.repeat)
+        print_row(name, results[name])
+
+    if args.save:
+        with open(args.save, mode='w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = find_regressions(results, hBt.load_json(args.baseline), args.threshold)
+        print(f'regression check: {"FAILED" if regressions else "ok"}')
+        failures += regressions
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,57 @@
+import os
 import json
 import pandas as pd
 import bt
-import ffn
 import ffn.utils as utils
 import yfinance
+import handleAPI.pricestore as pricestore
+import handleAPI.engine as engine
+import handleAPI.cache as cache
+import handleAPI.metrics as metrics
+import handleAPI.timing as timing
 
 # 2022-12-22: Yahoo made changes to an underlying API that broke compatiblity
 # Temp fix: Use yfinance.pdr_override() until a permanent fix, probably in
 # pandas_datareader.data.get_data_yahoo(), is available
 yfinance.pdr_override()
 
+# Prices are served through the local store (see handleAPI/pricestore.py):
+# repeat requests for the same tickers cost a disk read instead of one
+# HTTP round trip per ticker. Set PRICE_SOURCE=yahoo to bypass it, or
+# PRICE_SOURCE=file to run from local CSV files with no network.
+price_source = pricestore.get_source()
+
+# Backtest engine: 'vector' evaluates all portfolios at once in NumPy
+# (see handleAPI/engine.py), 'bt' keeps the original per-portfolio
+# bt.Strategy objects as a reference mode.
+BACKTEST_ENGINE = os.environ.get('BACKTEST_ENGINE', 'vector')
+
+
+def load_json(path):
+    with open(path, mode='r', encoding='utf8') as f:
+        return json.load(f)
+
+
+# Metadata files are static, load them once instead of on every request
+metric_info = load_json('data/metric_info.json')
+metric_groups = load_json('data/metric_groups.json')
+result_metadatas = load_json('data/result_metadata.json')
+metric_registry = metrics.MetricRegistry(metric_info, metric_groups)
+
+# Finished results, keyed on the canonical request (see handleAPI/cache.py)
+result_cache = cache.ResultCache()
+
 
 def clean_portfolios(portfolios):
     # List comprehension to return a new portfolios list containing only non-empty portfolios, i.e. any non-zero asset allocation
     return [p for p in portfolios if any(asset["allocation"] != 0.0 for asset in p["assets"])]
 
 
-def download(start, end, portfolios, allocations=None):
+def download(start, end, portfolios, allocations=None, source=None):
     if allocations is None:
         allocations = []
+    if source is None:
+        source = price_source
     tickers = []
     for portfolio in portfolios:
         assets = {}
@@ -32,7 +65,7 @@ def download(start, end, portfolios, allocations=None):
                 tickers.append(ticker)
         allocations.append(assets)
 
-    prices = bt.get(tickers, start=start, end=end)
+    prices = pricestore.get_prices(tickers, start=start, end=end, source=source)
     return prices
 
 
@@ -46,81 +79,91 @@ def set_backtest(prices, strategy_name, weight):
     return backtest
 
 
-def run_backtest(start, end, portfolios):
+def run_strategies(prices, portfolios, allocations, engine_name=None):
+    if engine_name is None:
+        engine_name = BACKTEST_ENGINE
+    if engine_name == 'bt':
+        with timing.span('build'):
+            backtests = []
+            for i in range(len(portfolios)):
+                t = set_backtest(prices, portfolios[i]["name"], allocations[i])
+                backtests.append(t)
+        # bt.backtest.Result is a GroupStats, its prices are the merged
+        # strategy prices
+        with timing.span('run'):
+            return bt.run(*backtests).prices
+    elif engine_name == 'vector':
+        names = [p["name"] for p in portfolios]
+        with timing.span('build'):
+            weights = engine.weight_matrix(prices.columns, allocations)
+        with timing.span('run'):
+            return engine.run_matrix(prices, weights, names)
+    raise ValueError(f'Unknown backtest engine: {engine_name}')
+
+
+# Stages are timed with handleAPI/timing.py spans: download, build, run,
+# metrics, drawdowns, corr (and serialize, in serialize.encode())
+def calc_backtest(start, end, portfolios, engine_name=None, source=None):
     portfolios = clean_portfolios(portfolios)
     allocations = []
-    a_prices = download(start, end, portfolios, allocations)
-    backtests = []
-    for i in range(len(portfolios)):
-        t = set_backtest(a_prices, portfolios[i]["name"], allocations[i])
-        backtests.append(t)
-
-    p_stats = bt.run(*backtests)
-    
-    a_stats = ffn.calc_stats(a_prices)
-    # Type returned from bt.run() is bt.backtest.Result, which is inherited from GroupStats
-    # Type returned from ffn.calc_stats(): Series -> PerformanceStats | DataFrame -> GroupStats
+    with timing.span('download'):
+        a_prices = download(start, end, portfolios, allocations, source)
+    p_prices = run_strategies(a_prices, portfolios, allocations, engine_name)
 
+    # Metrics are computed lazily by handleAPI/metrics.py, only for the
+    # metric groups that are returned, instead of ffn.calc_stats()' full suite
     rf = 0.01   # Set risk-free rate, which is used in Sharpe Ratio calculations
-    p_stats.set_riskfree_rate(rf)
-    a_stats.set_riskfree_rate(rf)
-
-    with open('data/metric_info.json', mode='r', encoding='utf8') as f:
-        metric_info = json.load(f)
-    with open('data/metric_groups.json', mode='r', encoding='utf8') as f:
-        metric_groups = json.load(f)
-    with open('data/result_metadata.json', mode='r', encoding='utf8') as f:
-        result_metadatas = json.load(f)
+    p_metrics = metrics.MetricContext(p_prices, rf=rf)
+    a_metrics = metrics.MetricContext(a_prices, rf=rf)
 
     # The below code first checks metadatas['metricGroup'] in each item of the 
     # result_metadatas dictionary. 
     # If it is not None, it checks the value of metadatas['subject'] to determine 
-    # whether to use p_stats.stats (portfolio stats) or a_stats.stats (asset stats) 
+    # whether to use p_metrics (portfolio prices) or a_metrics (asset prices) 
     # as the source of the data. It then looks up the appropriate list of metric keys
-    # from the metric_groups dictionary using metadatas['metricGroup'], filters the 
-    # source data to include only the desired metrics, and adds a new column to the 
-    # resulting DataFrame with the corresponding label. The resulting DataFrame is 
-    # then appended to the dfs list along with the key from the result_metadatas dict.
+    # from the metric_groups dictionary using metadatas['metricGroup'] and computes
+    # only those metrics. The resulting DataFrame is 
+    # then appended to the dfs list along with the key from the result_metadatas dict
+    # (twice: as its section and as its name in the output).
     # If it is None, it checks the value of result to determine which of several cases
-    # to handle next. Basically it sources the data from either p_stats or a_stats.
+    # to handle next. Basically it sources the data from either p_metrics or a_metrics.
     dfs = []
     for result, metadatas in result_metadatas.items():
         if metadatas['metricGroup'] is not None:
             if metadatas['subject'] == "portfolio":
-                stats = p_stats.stats
+                context = p_metrics
             elif metadatas['subject'] == "asset":
-                stats = a_stats.stats
+                context = a_metrics
             else:
-                stats = None
                 continue
-            metrics = metric_groups.get(metadatas['metricGroup'], [])
-            df = stats.filter(items=metrics, axis=0)
+            with timing.span('metrics'):
+                df = metric_registry.compute(context, metric_registry.group(metadatas['metricGroup']))
             # labelCns = [metric_info[m]['labelCn'] for m in metrics]
             # df.insert(0, 'labelCn', labelCns)
-            dfs.append((result, df))
+            dfs.append((result, result, df))
         else:
             if result == "port_perf_chart":
-                df = p_stats.prices
-                dfs.append((result, df))
+                df = p_prices
+                dfs.append((result, result, df))
            
             elif result == "drawdown_chart":
-                df = ffn.to_drawdown_series(p_stats.prices)
-                dfs.append((result, df))
+                with timing.span('drawdowns'):
+                    df = p_metrics.drawdown
+                dfs.append((result, result, df))
 
             elif result == "drawdowns":
-                for i in range(len(portfolios)):
-                    if p_stats[i].drawdown_details is not None:
-                        df = p_stats[i].drawdown_details.sort_values('drawdown').head(5)
-                        dfs.append((portfolios[i]['name'] + " " + result, df))
+                with timing.span('drawdowns'):
+                    for i in range(len(portfolios)):
+                        details = p_metrics.drawdown_details[portfolios[i]['name']]
+                        if details is not None:
+                            df = details.sort_values('drawdown').head(5)
+                            dfs.append((result, portfolios[i]['name'] + " " + result, df))
 
             elif result == "asset_corr":
-                df = a_prices.pct_change().corr()
-                dfs.append((result, df))
-
-    out_json = {}
-    for result, df in dfs:
-        df_json = df.to_json(orient='split', date_format='iso')
-        out_json[result] = json.loads(df_json)
+                with timing.span('corr'):
+                    df = a_prices.pct_change().corr()
+                dfs.append((result, result, df))
 
-    out_json = json.dumps(out_json)
-    return out_json
+    # Encoding is left to handleAPI/serialize.py, so cached results can be
+    # served in any format / selection
+    return dfs
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import pandas as pd
+
+# Backtest result cache in front of the job tier (handleAPI/jobs.py).
+#
+# The UI keeps sending the same [start, end, portfolios] payloads (reloads,
+# shared links, the defaults in data/portfolios.json), so finished results
+# are kept keyed on a canonical form of the request:
+#   - portfolios without any non-zero allocation are dropped, like
+#     backtester.clean_portfolios()
+#   - tickers are stripped and upper-cased (not ffn.utils.clean_ticker,
+#     which maps different symbols such as BW^A and BWA to the same name)
+#   - portfolio order, names and asset order are kept, since they are part
+#     of the result (asset columns follow the download order)
+#   - the end date is clamped to the last day that can have data (today)
+#
+# Entries live in an LRU bounded by total size and expire at the next US
+# market close, when a new daily bar (and possibly adjusted history) is out.
+# Evicted entries can optionally spill to disk.
+
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+CACHE_SPILL_DIR = os.environ.get('CACHE_SPILL_DIR')     # unset = no disk spill
+
+MARKET_TZ = ZoneInfo('America/New_York')
+MARKET_CLOSE_HOUR = 16
+# Give the data provider some time to publish the closing prices
+MARKET_CLOSE_DELAY = timedelta(minutes=30)
+
+
+def canonical_request(start, end, portfolios):
+    today = pd.Timestamp.today().normalize()
+    start = pd.Timestamp(start).normalize()
+    # yfinance's end date is exclusive, so nothing after today + 1 can change
+    # the result
+    end = min(pd.Timestamp(end).normalize(), today + pd.Timedelta(days=1))
+    canonical = []
+    for portfolio in portfolios:
+        if not any(asset["allocation"] != 0.0 for asset in portfolio["assets"]):
+            continue
+        assets = [(asset["ticker"].strip().upper(), float(asset["allocation"]))
+                  for asset in portfolio["assets"]]
+        canonical.append([portfolio["name"], assets])
+    return [start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), canonical]
+
+
+def canonical_key(start, end, portfolios):
+    canonical = json.dumps(canonical_request(start, end, portfolios), separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+
+def next_market_close(now=None):
+    # Epoch seconds of the next market close (+ delay), skipping weekends
+    now = datetime.now(MARKET_TZ) if now is None else now.astimezone(MARKET_TZ)
+    close = now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0) + MARKET_CLOSE_DELAY
+    if close <= now:
+        close += timedelta(days=1)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+    return close.timestamp()
+
+
+class ResultCache:
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, spill_dir=CACHE_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self._entries = OrderedDict()   # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(value):
+        # Approximate memory footprint of a cached result
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        if isinstance(value, (list, tuple)):
+            return sum(ResultCache._size(v) for v in value)
+        return len(pickle.dumps(value))
+
+    def _spill_file(self, key):
+        return os.path.join(self.spill_dir, key + '.pkl')
+
+    def _spill(self, key, expires_at, value):
+        if not self.spill_dir or expires_at <= time.time():
+            return
+        tmp = self._spill_file(key) + '.tmp'
+        with open(tmp, mode='wb') as f:
+            pickle.dump({'expires_at': expires_at, 'value': value}, f)
+        os.replace(tmp, self._spill_file(key))
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        file = self._spill_file(key)
+        try:
+            with open(file, mode='rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry['expires_at'] <= time.time():
+            os.remove(file)
+            return None
+        return entry['expires_at'], entry['value']
+
+    def _pop(self, key):
+        expires_at, value, size = self._entries.pop(key)
+        self._bytes -= size
+        return expires_at, value
+
+    def _insert(self, key, expires_at, value):
+        if key in self._entries:
+            self._pop(key)
+        size = self._size(value)
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            old_key = next(iter(self._entries))
+            old_expires_at, old_value = self._pop(old_key)
+            self.evictions += 1
+            self._spill(old_key, old_expires_at, old_value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._pop(key)
+            entry = self._load_spilled(key)
+            if entry is not None:
+                self._insert(key, *entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, expires_at=None):
+        if expires_at is None:
+            expires_at = next_market_close()
+        with self._lock:
+            self._insert(key, expires_at, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+            }
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# Vectorized replacement for the per-portfolio bt.Strategy objects built in
+# backtester.set_backtest().
+#
+# Every portfolio shares the same price matrix and the same yearly schedule,
+# so instead of walking bt's node tree day by day for each portfolio, all N
+# portfolios are evaluated at once:
+#   values (days x portfolios) = prices (days x assets) x positions (assets x portfolios) + cash
+# with positions only changing on rebalance dates.
+#
+# It follows bt's semantics for
+#   bt.Strategy(name, [RunYearly(), SelectAll(), WeighSpecified(**w), Rebalance()])
+#   bt.Backtest(strategy, prices, initial_capital=1000000.0)
+# namely:
+#   - bt.Backtest prepends a dummy row one day before the first date, on
+#     which the strategy only holds its initial capital (price = 100)
+#   - RunYearly rebalances on the first real date and on every date whose
+#     year differs from the previous date
+#   - Rebalance targets weight * portfolio value per asset; with bt's default
+#     integer_positions=True the share count is floored, the rest stays cash
+#   - no commissions
+# and it repeats bt's floating point operations in the same order, so that
+# values which are equal in exact arithmetic (e.g. the first day's value and
+# the initial capital, which decide where drawdowns start) compare the same:
+#   - a portfolio's value is its cash plus each position's value, summed
+#     asset by asset
+#   - trades are bought / sold asset by asset, each one's cost taken from
+#     cash in turn
+#   - strategy prices chain the daily returns (price * (1 + return))
+# Assets are traded in column order, which is bt's order when the
+# portfolios list their assets in the same order as the downloaded columns.
+
+
+def yearly_rebalance_mask(dates):
+    # Boolean mask over dates: True where RunYearly() would fire
+    years = pd.DatetimeIndex(dates).year.values
+    mask = np.empty(len(years), dtype=bool)
+    if len(years):
+        mask[0] = True
+        mask[1:] = years[1:] != years[:-1]
+    return mask
+
+
+def weight_matrix(columns, allocations):
+    # allocations: list of {clean_ticker: weight} dicts, as built by
+    # backtester.download(). Returns (assets x portfolios) weights.
+    columns = list(columns)
+    weights = np.zeros((len(columns), len(allocations)))
+    for j, assets in enumerate(allocations):
+        for ticker, weight in assets.items():
+            weights[columns.index(ticker), j] = weight
+    return weights
+
+
+def run_weights(prices, weights, initial_capital=1000000.0, integer_positions=True, rebalance_mask=None):
+    # prices: (days x assets) ndarray, weights: (assets x portfolios) ndarray
+    # Returns the (days x portfolios) portfolio values, without the dummy row.
+    prices = np.asarray(prices, dtype='float64')
+    weights = np.asarray(weights, dtype='float64')
+    if rebalance_mask is None:
+        rebalance_mask = np.zeros(len(prices), dtype=bool)
+        rebalance_mask[:1] = True
+    n_assets, n_ports = weights.shape
+    values = np.empty((len(prices), n_ports))
+    rebalance_days = np.flatnonzero(rebalance_mask)
+    if len(rebalance_days) == 0 or rebalance_days[0] != 0:
+        rebalance_days = np.concatenate([[0], rebalance_days])
+    segment_ends = np.append(rebalance_days[1:], len(prices))
+
+    positions = np.zeros_like(weights)
+    cash = np.full(n_ports, float(initial_capital))
+    for start, end in zip(rebalance_days, segment_ends):
+        price = prices[start]
+        # Value at today's prices, before trading
+        value = portfolio_values(price[np.newaxis, :], positions, cash)[0]
+        for i in range(n_assets):
+            # bt trades the difference between the target and the current
+            # weight, flooring the share count; a zero weight closes the
+            # position
+            with np.errstate(invalid='ignore', divide='ignore'):
+                amount = (weights[i] - positions[i] * price[i] / value) * value
+                trade = amount / price[i]
+            if integer_positions:
+                trade = np.floor(trade)
+            trade = np.where(weights[i] == 0, -positions[i], trade)
+            positions[i] = positions[i] + trade
+            cash = cash - trade * price[i]
+        values[start:end] = portfolio_values(prices[start:end], positions, cash)
+    return values
+
+
+def portfolio_values(prices, positions, cash):
+    # (days x portfolios) cash + sum of position values, summed asset by
+    # asset like bt rather than through a matrix product
+    values = np.repeat(cash[np.newaxis, :], len(prices), axis=0)
+    for i in range(positions.shape[0]):
+        values = values + prices[:, i, np.newaxis] * positions[i][np.newaxis, :]
+    return values
+
+
+def strategy_prices(index, values, names, initial_capital=1000000.0):
+    # Portfolio values -> strategy prices starting at 100, with bt's dummy
+    # first row one day before the first date. Like bt, the prices chain
+    # the daily returns rather than dividing by the initial capital.
+    index = index.insert(0, index[0] - pd.DateOffset(days=1))
+    values = np.vstack([np.full(len(names), float(initial_capital)), values])
+    growth = np.vstack([np.full(len(names), 100.0), 1 + (values[1:] / values[:-1] - 1)])
+    return pd.DataFrame(np.cumprod(growth, axis=0), index=index, columns=names)
+
+
+def run_matrix(prices, weights, names, initial_capital=1000000.0, integer_positions=True):
+    # Equivalent of bt.run(*[set_backtest(prices, name, weight) ...]).prices,
+    # with the (assets x portfolios) weights from weight_matrix(): a
+    # DataFrame of strategy prices rebased to 100, one column per
+    # portfolio, including bt's dummy first row.
+    values = run_weights(prices.values, weights,
+                         initial_capital=initial_capital,
+                         integer_positions=integer_positions,
+                         rebalance_mask=yearly_rebalance_mask(prices.index))
+    return strategy_prices(prices.index, values, names, initial_capital)
@@ -0,0 +1,322 @@
+import os
+import time
+import uuid
+import queue
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import json
+import hashlib
+import handleAPI.cache as cache
+import handleAPI.timing as timing
+
+# Backtest job tier.
+#
+# Backtests are CPU bound and hold the GIL, so running them inside the
+# waitress request threads stalls every other request (keyword searches
+# included). Jobs run in a bounded ProcessPoolExecutor instead; its workers
+# import bt, ffn and pandas once in the initializer and stay warm.
+#
+# The manager also
+#   - returns finished results straight from backtester.result_cache
+#   - deduplicates identical in-flight requests (same canonical key)
+#   - enforces a per-job timeout: a monitor thread kills the worker of a
+#     job running longer than JOB_TIMEOUT and recycles the pool; jobs the
+#     pool took down with it are run again, up to JOB_RETRIES times
+#   - refuses new jobs with QueueFull once JOB_QUEUE_SIZE are pending
+#   - observes the stage timings measured in the worker (handleAPI/timing.py)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 120))
+JOB_RETRIES = int(os.environ.get('JOB_RETRIES', 1))
+# How long finished jobs can still be looked up by id
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 600))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+# Set in each worker by init_worker(): a queue of (job id, pid) messages
+# telling the manager which worker process runs which job
+_started = None
+
+
+def init_worker(started):
+    global _started
+    _started = started
+    # Pay the bt/ffn/pandas import once per worker, not once per job
+    import handleAPI.backtester  # noqa: F401
+
+
+def _run_timed(job_id, fn, *args):
+    # Returns (result, [(stage, seconds), ...])
+    _started.put((job_id, os.getpid()))
+    with timing.collect() as spans:
+        result = fn(*args)
+    return result, spans.items()
+
+
+def run_job(job_id, start, end, portfolios):
+    import handleAPI.backtester as hBt
+    return _run_timed(job_id, hBt.calc_backtest, start, end, portfolios)
+
+
+def run_sweep_job(job_id, req):
+    import handleAPI.backtester as hBt
+    import handleAPI.sweep as sweep
+    return _run_timed(job_id, sweep.sweep, req, hBt.metric_registry, hBt.price_source)
+
+
+def sweep_key(req):
+    canonical = json.dumps(req, sort_keys=True, separators=(',', ':'))
+    return 'sweep-' + hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+
+class Job:
+    # future is owned by the manager, not the pool: a job can outlive the
+    # pool attempt running it (timeouts, retries on a fresh pool)
+
+    def __init__(self, key, fn=None, args=(), result=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.future = Future() if fn is not None else None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None if fn is not None else self.submitted_at
+        self.pid = None
+        self.retries = 0
+        self._result = result
+
+    @property
+    def status(self):
+        if self.future is None:
+            return DONE
+        if not self.future.done():
+            return RUNNING if self.started_at is not None else QUEUED
+        if self.future.cancelled():
+            return FAILED
+        error = self.future.exception()
+        if error is None:
+            return DONE
+        return TIMEOUT if isinstance(error, JobTimeout) else FAILED
+
+    def result(self, timeout=None):
+        if self.future is None:
+            return self._result
+        return self.future.result(timeout=timeout)[0]
+
+    def spans(self):
+        # Stage timings of the run that produced the result, empty when it
+        # came from the cache or is not finished
+        if self.future is None or self.status != DONE:
+            return []
+        return self.future.result()[1]
+
+    def error(self):
+        if self.future is None or not self.future.done():
+            return None
+        if self.future.cancelled():
+            return 'Job was cancelled'
+        error = self.future.exception()
+        if isinstance(error, JobTimeout):
+            return 'Job timed out'
+        return None if error is None else f'ERROR : {error}'
+
+    def info(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at,
+            'message': self.error() or '',
+        }
+
+
+class JobManager:
+
+    def __init__(self, result_cache, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE,
+                 timeout=JOB_TIMEOUT, retention=JOB_RETENTION):
+        self.result_cache = result_cache
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retention = retention
+        self._executor = None
+        self._started = None
+        self._monitor = None
+        self._closed = False
+        self._jobs = {}         # job id -> Job
+        self._in_flight = {}    # canonical key -> Job
+        # Reentrant: a pool future that is already done runs its callback
+        # straight away, inside _start()
+        self._lock = threading.RLock()
+
+    def _get_executor(self):
+        # Created on first use and again after a worker was killed; 'spawn'
+        # because forking a threaded server can copy held locks into the
+        # children
+        if self._executor is None:
+            context = multiprocessing.get_context('spawn')
+            self._started = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=init_worker,
+                initargs=(self._started,))
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._watch, daemon=True)
+                self._monitor.start()
+        return self._executor
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.finished_at is not None and now - j.finished_at > self.retention]:
+            del self._jobs[job_id]
+
+    def _start(self, job):
+        # Runs one attempt of the job in the pool; called with the lock held
+        try:
+            attempt = self._get_executor().submit(job.fn, job.id, *job.args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool
+            self._executor = None
+            attempt = self._get_executor().submit(job.fn, job.id, *job.args)
+        attempt.add_done_callback(lambda f: self._attempt_done(job, f))
+
+    def _attempt_done(self, job, attempt):
+        with self._lock:
+            if job.finished_at is not None:
+                # Already timed out
+                return
+            if attempt.cancelled():
+                job.finished_at = time.time()
+                self._in_flight.pop(job.key, None)
+                job.future.cancel()
+                return
+            error = attempt.exception()
+            if isinstance(error, BrokenProcessPool) and job.retries < JOB_RETRIES:
+                # The pool went down under this job, usually because another
+                # job's worker was killed: run it again on a fresh pool
+                job.retries += 1
+                job.started_at = job.pid = None
+                self._start(job)
+                return
+        if error is not None:
+            self._finish(job, error=error)
+        else:
+            self._finish(job, result=attempt.result())
+
+    def _finish(self, job, result=None, error=None):
+        with self._lock:
+            if job.finished_at is not None:
+                return False
+            job.finished_at = time.time()
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+        if error is not None:
+            # Failed jobs are not cached
+            job.future.set_exception(error)
+            return True
+        value, spans = result
+        timing.stage_seconds.observe_spans(spans)
+        self.result_cache.put(job.key, value)
+        job.future.set_result(result)
+        return True
+
+    def _watch(self):
+        # Monitor thread: records which worker started which job, and kills
+        # the worker of any job running longer than the timeout. Works the
+        # same on every platform (no SIGALRM on Windows).
+        while not self._closed:
+            try:
+                job_id, pid = self._started.get(timeout=0.5)
+            except (queue.Empty, OSError, ValueError, EOFError):
+                pass
+            else:
+                with self._lock:
+                    job = self._jobs.get(job_id)
+                    if job is not None and job.finished_at is None:
+                        job.pid = pid
+                        job.started_at = time.time()
+            self._kill_overdue()
+
+    def _kill_overdue(self):
+        now = time.time()
+        with self._lock:
+            overdue = [job for job in self._in_flight.values()
+                       if job.started_at is not None and now - job.started_at > self.timeout]
+        for job in overdue:
+            if self._finish(job, error=JobTimeout()):
+                self._recycle(job.pid)
+
+    def _recycle(self, pid):
+        # Killing a worker breaks its whole pool; new and retried jobs go to
+        # a fresh one
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def submit(self, start, end, portfolios):
+        key = cache.canonical_key(start, end, portfolios)
+        return self._submit(key, run_job, start, end, portfolios)
+
+    def submit_sweep(self, req):
+        return self._submit(sweep_key(req), run_sweep_job, req)
+
+    def _submit(self, key, fn, *args):
+        with self._lock:
+            self._purge()
+            job = self._in_flight.get(key)
+            if job is not None:
+                return job
+            result = self.result_cache.get(key)
+            if result is not None:
+                job = Job(key, result=result)
+                self._jobs[job.id] = job
+                return job
+            if len(self._in_flight) >= self.queue_size:
+                raise QueueFull(f'Too many pending backtests ({len(self._in_flight)})')
+            job = Job(key, fn, args)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            self._start(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job):
+        try:
+            return job.result(timeout=self.timeout + 5)
+        except (JobTimeout, FutureTimeout):
+            raise TimeoutError('Job timed out')
+
+    def shutdown(self):
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
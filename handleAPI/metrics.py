@@ -0,0 +1,283 @@
+import numpy as np
+import pandas as pd
+from functools import cached_property
+import ffn
+
+# Lazy metric engine used instead of ffn.calc_stats() / bt's Result stats.
+#
+# ffn's PerformanceStats computes its whole stats suite (daily / monthly /
+# yearly resampling, skew, kurtosis, drawdown details, return tables...) for
+# every series, while the API only returns the metrics listed in
+# data/metric_groups.json. Here every metric in data/metric_info.json has its
+# own function, evaluated for all columns at once, and intermediate results
+# (monthly prices, returns, drawdowns...) are computed on first use and
+# shared through a MetricContext.
+#
+# The formulas, and the data-length checks that make ffn leave a metric NaN,
+# follow ffn 0.3.7 (PerformanceStats._calculate). Prices are expected to be
+# NaN-free with one shared index, which holds for both the downloaded asset
+# prices (common dates only) and the backtest prices.
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def to_returns(prices):
+    return prices / prices.shift(1) - 1
+
+
+def deannualize(rate, nperiods):
+    return np.power(1 + rate, 1.0 / nperiods) - 1.0
+
+
+def sharpe(returns, rf, nperiods):
+    er = returns - deannualize(rf, nperiods)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return er.mean() / er.std(ddof=1) * np.sqrt(nperiods)
+
+
+def sortino(returns, rf, nperiods):
+    er = returns - deannualize(rf, nperiods)
+    negative = np.minimum(er.iloc[1:], 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return er.mean() / negative.std(ddof=1) * np.sqrt(nperiods)
+
+
+def year_frac(start, end):
+    return (end - start).total_seconds() / 31557600
+
+
+def cagr(prices):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (prices.iloc[-1] / prices.iloc[0]) ** (1 / year_frac(prices.index[0], prices.index[-1])) - 1
+
+
+def drawdown_series(prices):
+    prices = prices.ffill()
+    return prices / prices.cummax() - 1.0
+
+
+# ffn stops computing at the first of these checks that fails, leaving
+# every later metric NaN. Each entry: (minimum index spacing below which the
+# check applies (None = always), failed(context)).
+GUARDS = [
+    (None, lambda c: c.n_days == 0),
+    (None, lambda c: c.n_days == 1),
+    (None, lambda c: c.n_days < 2),
+    (None, lambda c: c.n_days < 4),
+    (None, lambda c: c.n_months < 2),
+    ('93 days', lambda c: c.n_months < 3),
+    ('32 days', lambda c: c.n_months < 4),
+    ('185 days', lambda c: c.n_months < 6),
+    ('367 days', lambda c: c.n_years < 2),
+    ('1097 days', lambda c: c.n_years < 3),
+    ('367 days', lambda c: c.n_years < 4),
+    ('1828 days', lambda c: c.n_years < 5),
+    ('3654 days', lambda c: c.n_years < 10),
+]
+
+
+class MetricContext:
+    # Shared, lazily computed intermediates for one price DataFrame
+
+    def __init__(self, prices, rf=0.0, annualization_factor=TRADING_DAYS_PER_YEAR):
+        self.prices = prices
+        self.rf = rf
+        self.annualization_factor = annualization_factor
+
+    @cached_property
+    def daily_prices(self):
+        return self.prices.dropna()
+
+    @cached_property
+    def monthly_prices(self):
+        return self.prices.resample('M').last()
+
+    @cached_property
+    def yearly_prices(self):
+        return self.prices.resample('A').last()
+
+    @cached_property
+    def returns(self):
+        return to_returns(self.daily_prices)
+
+    @cached_property
+    def monthly_returns(self):
+        return to_returns(self.monthly_prices)
+
+    @cached_property
+    def yearly_returns(self):
+        return to_returns(self.yearly_prices)
+
+    @cached_property
+    def drawdown(self):
+        return drawdown_series(self.daily_prices)
+
+    @cached_property
+    def drawdown_details(self):
+        # column -> ffn drawdown details DataFrame (or None)
+        return {c: ffn.core.drawdown_details(self.drawdown[c]) for c in self.prices.columns}
+
+    @cached_property
+    def n_days(self):
+        return len(self.daily_prices)
+
+    @cached_property
+    def n_months(self):
+        return len(self.monthly_prices)
+
+    @cached_property
+    def n_years(self):
+        return len(self.yearly_prices)
+
+    @cached_property
+    def min_spacing(self):
+        return self.daily_prices.index.to_series().diff().min()
+
+    def spaced_below(self, spacing):
+        # '<=2 days' is inclusive, plain '2 days' is strict, as in ffn
+        if spacing.startswith('<='):
+            return self.min_spacing <= pd.Timedelta(spacing[2:])
+        return self.min_spacing < pd.Timedelta(spacing)
+
+    @cached_property
+    def guards_passed(self):
+        passed = 0
+        for spacing, failed in GUARDS:
+            if (spacing is None or self.spaced_below(spacing)) and failed(self):
+                break
+            passed += 1
+        return passed
+
+    def reached(self, guards, spacing=None):
+        return self.guards_passed >= guards and (spacing is None or self.spaced_below(spacing))
+
+    def nan(self):
+        return pd.Series(np.nan, index=self.prices.columns)
+
+    def lookback(self, offset):
+        # Return since the last price on or before (last date - offset)
+        dp = self.daily_prices
+        pos = dp.index.searchsorted(dp.index[-1] - offset, side='right') - 1
+        if pos < 0:
+            return self.nan()
+        return dp.iloc[-1] / dp.iloc[pos] - 1
+
+    def trailing_cagr(self, offset):
+        dp = self.daily_prices
+        return cagr(dp[dp.index >= dp.index[-1] - offset])
+
+
+def _period_to_date(c, periods):
+    dp = c.daily_prices
+    if len(periods) == 1:
+        return dp.iloc[-1] / dp.iloc[0] - 1
+    return dp.iloc[-1] / periods.iloc[-2] - 1
+
+
+def _avg_drawdown(c, column):
+    values = {}
+    for name, details in c.drawdown_details.items():
+        values[name] = details[column].mean() if details is not None else np.nan
+    return pd.Series(values)
+
+
+def _kurt(returns):
+    # ffn skips kurtosis when every return is zero / NaN
+    valid = (returns.notna() & (returns != 0)).any()
+    return returns.kurt().where(valid)
+
+
+# metric key -> (guards passed, index spacing required, function(context))
+METRICS = {
+    'start': (0, None, lambda c: pd.Series(c.prices.index[0], index=c.prices.columns)),
+    'end': (0, None, lambda c: pd.Series(c.prices.index[-1], index=c.prices.columns)),
+    'rf': (0, None, lambda c: pd.Series(c.rf, index=c.prices.columns)),
+
+    'total_return': (3, None, lambda c: c.prices.iloc[-1] / c.prices.iloc[0] - 1),
+    'cagr': (3, None, lambda c: cagr(c.daily_prices)),
+    'incep': (3, None, lambda c: cagr(c.daily_prices)),
+    'max_drawdown': (3, None, lambda c: c.drawdown.min()),
+    'calmar': (3, None, lambda c: cagr(c.daily_prices) / c.drawdown.min().abs()),
+    'avg_drawdown': (3, None, lambda c: _avg_drawdown(c, 'drawdown')),
+    'avg_drawdown_days': (3, None, lambda c: _avg_drawdown(c, 'Length')),
+
+    'mtd': (2, None, lambda c: _period_to_date(c, c.monthly_prices)),
+    'ytd': (2, None, lambda c: _period_to_date(c, c.yearly_prices)),
+    'three_month': (6, '93 days', lambda c: c.lookback(pd.DateOffset(months=3))),
+    'six_month': (8, '185 days', lambda c: c.lookback(pd.DateOffset(months=6))),
+    'one_year': (9, '367 days', lambda c: c.lookback(pd.DateOffset(years=1))),
+    'three_year': (10, '1097 days', lambda c: c.trailing_cagr(pd.DateOffset(years=3))),
+    'five_year': (12, '1828 days', lambda c: c.trailing_cagr(pd.DateOffset(years=5))),
+    'ten_year': (13, '3654 days', lambda c: c.trailing_cagr(pd.DateOffset(years=10))),
+
+    'daily_mean': (3, '2 days', lambda c: c.returns.mean() * c.annualization_factor),
+    'daily_vol': (3, '2 days', lambda c: c.returns.std(ddof=1) * np.sqrt(c.annualization_factor)),
+    'daily_sharpe': (3, '2 days', lambda c: sharpe(c.returns, c.rf, c.annualization_factor)),
+    'daily_sortino': (3, '2 days', lambda c: sortino(c.returns, c.rf, c.annualization_factor)),
+    'best_day': (3, '2 days', lambda c: c.returns.max()),
+    'worst_day': (3, '2 days', lambda c: c.returns.min()),
+    'daily_skew': (4, '<=2 days', lambda c: c.returns.skew()),
+    'daily_kurt': (4, '<=2 days', lambda c: _kurt(c.returns)),
+
+    'monthly_mean': (5, '32 days', lambda c: c.monthly_returns.mean() * 12),
+    'monthly_vol': (5, '32 days', lambda c: c.monthly_returns.std(ddof=1) * np.sqrt(12)),
+    'monthly_sharpe': (5, '32 days', lambda c: sharpe(c.monthly_returns, c.rf, 12)),
+    'monthly_sortino': (5, '32 days', lambda c: sortino(c.monthly_returns, c.rf, 12)),
+    'best_month': (5, '32 days', lambda c: c.monthly_returns.max()),
+    'worst_month': (5, '32 days', lambda c: c.monthly_returns.min()),
+    'avg_up_month': (5, '32 days', lambda c: c.monthly_returns.where(c.monthly_returns > 0).mean()),
+    'avg_down_month': (5, '32 days', lambda c: c.monthly_returns.where(c.monthly_returns <= 0).mean()),
+    'monthly_skew': (7, '32 days', lambda c: c.monthly_returns.skew()),
+    'monthly_kurt': (7, '32 days', lambda c: _kurt(c.monthly_returns)),
+
+    'yearly_mean': (9, '367 days', lambda c: c.yearly_returns.mean()),
+    'yearly_vol': (9, '367 days', lambda c: c.yearly_returns.std(ddof=1)),
+    'yearly_sharpe': (9, '367 days', lambda c: sharpe(c.yearly_returns, c.rf, 1)
+                      .where(c.yearly_returns.std(ddof=1) > 0)),
+    'yearly_sortino': (9, '367 days', lambda c: sortino(c.yearly_returns, c.rf, 1)),
+    'best_year': (9, '367 days', lambda c: c.yearly_returns.max()),
+    'worst_year': (9, '367 days', lambda c: c.yearly_returns.min()),
+    'win_year_perc': (9, '367 days', lambda c: (c.yearly_returns > 0).sum() / float(c.n_years - 1)),
+    'twelve_month_win_perc': (9, '367 days', lambda c: _twelve_month_win_perc(c)),
+    'yearly_skew': (11, '367 days', lambda c: c.yearly_returns.skew()),
+    'yearly_kurt': (11, '367 days', lambda c: _kurt(c.yearly_returns)),
+}
+
+# Metrics whose values are dates rather than numbers
+DATE_METRICS = ('start', 'end')
+
+
+def _twelve_month_win_perc(c):
+    mp = c.monthly_prices
+    if len(mp) <= 11:
+        return c.nan()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wins = mp.values[11:] / mp.values[:-11] > 1
+    return pd.Series(wins.mean(axis=0), index=mp.columns)
+
+
+class MetricRegistry:
+    # The metrics that can be served: the keys of metric_info.json that
+    # have an implementation in METRICS
+
+    def __init__(self, metric_info, metric_groups):
+        self.metric_info = metric_info
+        self.metric_groups = metric_groups
+        self.metrics = {k: METRICS[k] for k in metric_info if k in METRICS}
+
+    def group(self, name):
+        return self.metric_groups.get(name, [])
+
+    def compute(self, context, metrics):
+        # DataFrame of metrics (rows) x price columns, like
+        # GroupStats.stats.filter(items=metrics, axis=0)
+        rows = {}
+        for metric in metrics:
+            if metric not in self.metrics:
+                continue
+            guards, spacing, func = self.metrics[metric]
+            if context.reached(guards, spacing):
+                rows[metric] = func(context)
+            else:
+                rows[metric] = context.nan()
+        return pd.DataFrame(rows, columns=list(rows)).T.reindex(columns=context.prices.columns)
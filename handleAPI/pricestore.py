@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import ffn
+import ffn.utils as utils
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Price-source layer used by backtester.download().
+#
+# A source only has to implement fetch(ticker, start, end), returning a
+# pd.Series of adjusted close prices indexed by date for [start, end), i.e.
+# the same half-open range yfinance uses. Sources can be stacked: the
+# PriceStore wraps another source and keeps one memory-mappable NumPy file
+# per ticker on disk, so only the date ranges it has never seen go upstream.
+#
+# Files are named after the upper-cased symbol, percent-escaped for the
+# filesystem (GC=F -> GC%3DF), not ffn's clean_ticker: that one maps
+# different symbols to the same name (BW^A and BWA -> bwa).
+
+PRICE_SOURCE = os.environ.get('PRICE_SOURCE', 'store')     # store | yahoo | file
+PRICE_STORE_DIR = os.environ.get('PRICE_STORE_DIR', './PriceData')
+PRICE_FILE_DIR = os.environ.get('PRICE_FILE_DIR', './PriceFiles')
+# How often the not-yet-final tail (today onwards) is re-downloaded
+PRICE_REFRESH_SECONDS = int(os.environ.get('PRICE_REFRESH_SECONDS', 900))
+
+# On-disk record layout: dates as int64 nanoseconds + float64 close
+RECORD_DTYPE = np.dtype([('date', '<i8'), ('close', '<f8')])
+
+
+class DownloadError(Exception):
+    pass
+
+
+class FileLock:
+    # Exclusive lock on a file, held across processes: flock on POSIX,
+    # msvcrt.locking on Windows
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    # Gives up with OSError after 10 seconds, keep waiting
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+
+
+def ticker_key(ticker):
+    return quote(str(ticker).strip().upper(), safe='')
+
+
+def empty_series():
+    return pd.Series(dtype='float64', index=pd.DatetimeIndex([]))
+
+
+def to_timestamp(date):
+    # Normalize str / datetime / None to a tz-naive midnight Timestamp
+    if date is None:
+        return None
+    ts = pd.Timestamp(date)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts.normalize()
+
+
+def slice_range(series, start, end):
+    # Half-open [start, end) slice, matching yfinance's exclusive end date
+    start, end = to_timestamp(start), to_timestamp(end)
+    mask = np.ones(len(series), dtype=bool)
+    if start is not None:
+        mask &= series.index >= start
+    if end is not None:
+        mask &= series.index < end
+    return series[mask]
+
+
+class YahooSource:
+    # Network source: one ffn/yfinance request per ticker and date range
+
+    def fetch(self, ticker, start, end):
+        df = ffn.get(ticker, start=start, end=end,
+                     common_dates=False, clean_tickers=False)
+        if df is None or df.empty:
+            # yfinance returns an empty frame rather than raising when it
+            # is throttled or fails
+            return empty_series()
+        series = df.iloc[:, 0].dropna().astype('float64')
+        series.index = pd.DatetimeIndex(series.index)
+        if series.index.tz is not None:
+            series.index = series.index.tz_localize(None)
+        return series
+
+
+class FileSource:
+    # Offline source: reads <ticker_key>.csv (Date,Close) from a directory,
+    # so backtests can run with no network at all
+
+    def __init__(self, path=PRICE_FILE_DIR):
+        self.path = path
+
+    def fetch(self, ticker, start, end):
+        file = os.path.join(self.path, ticker_key(ticker) + '.csv')
+        if not os.path.exists(file):
+            raise FileNotFoundError(f'No price file for {ticker}: {file}')
+        df = pd.read_csv(file, index_col=0, parse_dates=True)
+        series = df.iloc[:, 0].dropna().astype('float64').sort_index()
+        return slice_range(series, start, end)
+
+
+class PriceStore:
+    # Incremental on-disk store in front of another source.
+    #
+    # For every ticker it keeps <ticker_key>.npy (RECORD_DTYPE, sorted by
+    # date, opened with mmap_mode='r') and <ticker_key>.json holding the
+    # covered range. The covered range is tracked separately from the data
+    # because a requested range may legitimately start or end on a day with
+    # no trading, and those should not trigger a refetch either.
+    #
+    # Every backtest worker process has its own PriceStore on the same
+    # directory, so load - merge - save runs under <ticker_key>.lock (a
+    # FileLock); otherwise two workers extending a ticker could leave one's
+    # data with the other's covered range.
+
+    def __init__(self, upstream=None, path=PRICE_STORE_DIR, refresh_seconds=PRICE_REFRESH_SECONDS):
+        self.upstream = upstream if upstream is not None else YahooSource()
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._ticker_locks = {}
+        self._tail_fetched = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def _ticker_lock(self, key):
+        with self._lock:
+            if key not in self._ticker_locks:
+                self._ticker_locks[key] = threading.Lock()
+            return self._ticker_locks[key]
+
+    def _files(self, key):
+        base = os.path.join(self.path, key)
+        return base + '.npy', base + '.json'
+
+    def _file_lock(self, key):
+        return FileLock(os.path.join(self.path, key + '.lock'))
+
+    def _load(self, key):
+        data_file, range_file = self._files(key)
+        if not (os.path.exists(data_file) and os.path.exists(range_file)):
+            return None, None
+        with open(range_file, mode='r', encoding='utf8') as f:
+            covered = json.load(f)
+        records = np.load(data_file, mmap_mode='r')
+        series = pd.Series(np.asarray(records['close']),
+                           index=pd.DatetimeIndex(np.asarray(records['date']).astype('datetime64[ns]')),
+                           dtype='float64')
+        return series, (to_timestamp(covered['start']), to_timestamp(covered['end']))
+
+    def _save(self, key, series, covered):
+        data_file, range_file = self._files(key)
+        records = np.empty(len(series), dtype=RECORD_DTYPE)
+        records['date'] = series.index.values.astype('datetime64[ns]').astype('int64')
+        records['close'] = series.values
+        # Write to temp files and swap in, so a reader never sees a
+        # half-written file
+        tmp = f'.{os.getpid()}.tmp'
+        tmp_data, tmp_range = data_file + tmp + '.npy', range_file + tmp
+        np.save(tmp_data, records)
+        with open(tmp_range, mode='w', encoding='utf8') as f:
+            json.dump({'start': covered[0].isoformat(), 'end': covered[1].isoformat()}, f)
+        os.replace(tmp_data, data_file)
+        os.replace(tmp_range, range_file)
+
+    def missing_ranges(self, covered, start, end):
+        # Ranges of [start, end) not inside the covered range. Both returned
+        # ranges extend up to the covered range, so coverage stays contiguous.
+        if covered is None:
+            return [(start, end)]
+        missing = []
+        if start < covered[0]:
+            missing.append((start, covered[0]))
+        if end > covered[1]:
+            missing.append((covered[1], end))
+        return missing
+
+    @staticmethod
+    def rebase(stored, part):
+        # Yahoo's adjusted close is back-adjusted: every dividend or split
+        # rescales all earlier prices. Each download overlaps the stored
+        # history by one date, and the stored prices are rescaled to the
+        # new download's basis by the ratio on that date.
+        overlap = stored.index.intersection(part.index)
+        if len(overlap) == 0:
+            return stored
+        ratio = part[overlap[-1]] / stored[overlap[-1]]
+        if np.isfinite(ratio) and not np.isclose(ratio, 1.0, rtol=1e-12, atol=0.0):
+            stored = stored * ratio
+        return stored
+
+    def fetch(self, ticker, start, end):
+        key = ticker_key(ticker)
+        start = to_timestamp(start)
+        # Never mark today or later as covered: today's bar is not final yet
+        today = pd.Timestamp.today().normalize()
+        end = to_timestamp(end) if end is not None else today + pd.Timedelta(days=1)
+        if start is None:
+            start = pd.Timestamp('1970-01-01')
+
+        with self._ticker_lock(key), self._file_lock(key):
+            series, covered = self._load(key)
+            missing = self.missing_ranges(covered, start, end)
+            # The range from today on can never become covered, so only go
+            # upstream for it once every refresh_seconds
+            tail_fetched = self._tail_fetched.get(key)
+            if tail_fetched is not None and time.time() - tail_fetched < self.refresh_seconds:
+                missing = [m for m in missing if m[0] < today]
+            if missing:
+                stored = series if series is not None else empty_series()
+                new_start, new_end = covered if covered is not None else (None, None)
+                parts = []
+                for m_start, m_end in missing:
+                    # Extend the range by one stored date to rebase on
+                    if len(stored) and m_start >= stored.index[-1]:
+                        m_start = stored.index[-1]
+                    elif len(stored) and m_end <= stored.index[0]:
+                        m_end = stored.index[0] + pd.Timedelta(days=1)
+                    part = self.upstream.fetch(ticker, m_start, m_end)
+                    if m_end > today:
+                        self._tail_fetched[key] = time.time()
+                    if part.empty:
+                        # Throttled / failed downloads come back empty rather
+                        # than raising, so an empty range is never marked
+                        # covered. With stored data the range includes a
+                        # stored date, so a real answer is never empty: fail
+                        # instead of returning a shorter series, which the
+                        # job tier would cache under the full request.
+                        if len(stored):
+                            raise DownloadError(f'No prices for {ticker} from {m_start.date()} to {m_end.date()}')
+                        continue
+                    stored = self.rebase(stored, part)
+                    parts.append(part)
+                    if new_start is None or m_start < new_start:
+                        new_start = m_start
+                    if new_end is None or min(m_end, today) > new_end:
+                        new_end = min(m_end, today)
+                merged = pd.concat([stored] + parts)
+                # Newer downloads win over stored values for the same date
+                merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+                if parts and new_end > new_start:
+                    self._save(key, merged, (new_start, new_end))
+                series = merged
+        return slice_range(series, start, end)
+
+
+def get_source(name=PRICE_SOURCE):
+    if name == 'yahoo':
+        return YahooSource()
+    elif name == 'file':
+        return FileSource()
+    elif name == 'store':
+        return PriceStore()
+    elif name == 'store-file':
+        return PriceStore(upstream=FileSource())
+    raise ValueError(f'Unknown price source: {name}')
+
+
+def get_prices(tickers, start, end, source):
+    # Same shape as bt.get(tickers, start, end): cleaned ticker columns,
+    # only the dates common to all tickers
+    data = {}
+    for ticker in tickers:
+        data[utils.clean_ticker(ticker)] = source.fetch(ticker, start, end)
+    prices = pd.DataFrame(data)
+    prices.index.name = 'Date'
+    return prices.dropna()
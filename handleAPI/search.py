@@ -0,0 +1,149 @@
+import json
+from bisect import bisect_left
+
+# In-memory symbol search index for the /api/keyword endpoints.
+#
+# Built once at startup instead of scanning the whole ticker list on every
+# keystroke. Results are ranked in tiers, each tier keeping the order of
+# the source list:
+#   1. exact symbol
+#   2. symbol prefix
+#   3. symbol substring
+#   4. name substring
+# and a search with a limit stops as soon as it has enough results.
+#
+# Substring lookups go through an n-gram index (all 1..NGRAM grams of every
+# symbol and name). Queries up to NGRAM characters are a single dict lookup;
+# longer ones intersect the posting lists of their NGRAM-grams and verify
+# the candidates.
+
+NGRAM = 3
+
+
+def normalize(text):
+    return str(text).lower().strip()
+
+
+def build_ngrams(texts, n=NGRAM):
+    index = {}
+    for i, text in enumerate(texts):
+        grams = set()
+        for size in range(1, n + 1):
+            for k in range(len(text) - size + 1):
+                grams.add(text[k:k + size])
+        for gram in grams:
+            index.setdefault(gram, []).append(i)
+    # ids were appended in list order, so every posting list is sorted
+    return index
+
+
+def parse_market_cap(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SymbolIndex:
+
+    def __init__(self, records, symbol_key='symbol', name_key='name',
+                 sector_key=None, industry_key=None, market_cap_key=None):
+        self.records = records
+        self.symbols = [normalize(r[symbol_key]) for r in records]
+        self.names = [normalize(r[name_key]) for r in records]
+
+        self.exact = {}
+        for i, symbol in enumerate(self.symbols):
+            self.exact.setdefault(symbol, []).append(i)
+        self.sorted_symbols = sorted((s, i) for i, s in enumerate(self.symbols))
+        self.symbol_grams = build_ngrams(self.symbols)
+        self.name_grams = build_ngrams(self.names)
+
+        # Optional attributes used for filtering (only in allStock.json)
+        self.sectors = [normalize(r.get(sector_key, '')) for r in records] if sector_key else None
+        self.market_caps = [parse_market_cap(r.get(market_cap_key)) for r in records] if market_cap_key else None
+        self.outputs = [self._output(r, symbol_key, name_key, sector_key, industry_key, market_cap_key)
+                        for r in records]
+
+    @staticmethod
+    def _output(record, symbol_key, name_key, sector_key, industry_key, market_cap_key):
+        out = {'symbol': record[symbol_key], 'name': record[name_key]}
+        if sector_key:
+            out['sector'] = record.get(sector_key, '')
+        if industry_key:
+            out['industry'] = record.get(industry_key, '')
+        if market_cap_key:
+            out['marketCap'] = parse_market_cap(record.get(market_cap_key))
+        return out
+
+    @classmethod
+    def from_all_stock(cls, path='./StockData/allStock.json'):
+        with open(path, mode='r', encoding='utf8') as f:
+            return cls(json.load(f), symbol_key='Symbol', name_key='Name',
+                       sector_key='Sector', industry_key='Industry',
+                       market_cap_key='Market Cap')
+
+    def _substring(self, grams, texts, query):
+        if len(query) <= NGRAM:
+            return grams.get(query, [])
+        postings = []
+        for k in range(len(query) - NGRAM + 1):
+            posting = grams.get(query[k:k + NGRAM])
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        return [i for i in sorted(candidates) if query in texts[i]]
+
+    def _prefix(self, query):
+        start = bisect_left(self.sorted_symbols, (query,))
+        ids = []
+        for symbol, i in self.sorted_symbols[start:]:
+            if not symbol.startswith(query):
+                break
+            ids.append(i)
+        return sorted(ids)
+
+    def _ranked(self, query):
+        # Lazily yields ids tier by tier, so callers can stop early
+        if not query:
+            yield from range(len(self.records))
+            return
+        yield from self.exact.get(query, [])
+        yield from self._prefix(query)
+        yield from self._substring(self.symbol_grams, self.symbols, query)
+        yield from self._substring(self.name_grams, self.names, query)
+
+    def _accept(self, i, sector, min_market_cap, max_market_cap):
+        if sector is not None and self.sectors is not None and self.sectors[i] != sector:
+            return False
+        if self.market_caps is not None and (min_market_cap is not None or max_market_cap is not None):
+            cap = self.market_caps[i]
+            if cap is None:
+                return False
+            if min_market_cap is not None and cap < min_market_cap:
+                return False
+            if max_market_cap is not None and cap > max_market_cap:
+                return False
+        return True
+
+    def search(self, query, limit=0, sector=None, min_market_cap=None, max_market_cap=None):
+        # limit 0 means no limit
+        query = normalize(query)
+        if sector is not None:
+            sector = normalize(sector)
+        results = []
+        seen = set()
+        for i in self._ranked(query):
+            if i in seen:
+                continue
+            seen.add(i)
+            if not self._accept(i, sector, min_market_cap, max_market_cap):
+                continue
+            results.append(self.outputs[i])
+            if limit and len(results) >= limit:
+                break
+        return results
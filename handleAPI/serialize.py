@@ -0,0 +1,145 @@
+import json
+import numpy as np
+import pandas as pd
+import handleAPI.timing as timing
+
+try:
+    import msgpack
+except ImportError:     # msgpack output is unavailable without it
+    msgpack = None
+
+# Serialization stage for backtest results.
+#
+# backtester.calc_backtest() returns a list of (section, name, DataFrame),
+# where section is a key of data/result_metadata.json and name is the key
+# in the output (the 'drawdowns' section has one name per portfolio).
+# encode() turns that into the response body:
+#   - sections: only return these result_metadata.json sections
+#   - points:   downsample daily chart series to about this many points
+#               (LTTB, see lttb_indices())
+#   - fmt:      'json'    -> {name: DataFrame.to_json(orient='split')}, each
+#                            frame encoded exactly once
+#               'msgpack' -> the same split layout, but numeric columns are
+#                            raw little-endian float32 arrays and dates are
+#                            int64 epoch milliseconds
+
+FORMATS = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+}
+
+
+class SerializeError(ValueError):
+    pass
+
+
+def select_sections(frames, sections=None):
+    if not sections:
+        return frames
+    return [(section, name, df) for section, name, df in frames if section in sections]
+
+
+def lttb_indices(values, n_out):
+    # Largest-Triangle-Three-Buckets over all columns at once: in each bucket
+    # keep the row forming the largest triangle (summed over the columns,
+    # each scaled to its own range) with the previously kept row and the
+    # average of the next bucket. First and last rows are always kept.
+    values = np.asarray(values, dtype='float64')
+    n = len(values)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    span = np.nanmax(values, axis=0) - np.nanmin(values, axis=0)
+    span[~(span > 0)] = 1.0
+    y = np.nan_to_num(values / span)
+    x = np.arange(n, dtype='float64')
+
+    every = (n - 2) / (n_out - 2)
+    edges = (np.arange(n_out - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean(axis=0)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end, np.newaxis]) * (avg_y - y[a])).sum(axis=1)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample(frames, points=None):
+    # Only daily chart series (DatetimeIndex) are reduced
+    if not points:
+        return frames
+    out = []
+    for section, name, df in frames:
+        if isinstance(df.index, pd.DatetimeIndex) and len(df) > points:
+            df = df.iloc[lttb_indices(df.values, points)]
+        out.append((section, name, df))
+    return out
+
+
+def to_json(frames):
+    parts = [json.dumps(name) + ':' + df.to_json(orient='split', date_format='iso')
+             for _, name, df in frames]
+    return '{' + ','.join(parts) + '}'
+
+
+def pack_values(values):
+    if isinstance(values, pd.DatetimeIndex) or pd.api.types.is_datetime64_any_dtype(values):
+        dates = pd.DatetimeIndex(values)
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        ms = dates.values.astype('datetime64[ms]').astype('<i8')
+        return {'dtype': 'datetime64[ms]', 'data': ms.tobytes()}
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return {'dtype': '<f4', 'data': np.asarray(values, dtype='<f4').tobytes()}
+    return {'dtype': 'object', 'data': [None if pd.isna(v) else
+                                        v.isoformat() if isinstance(v, pd.Timestamp) else
+                                        v.item() if isinstance(v, np.generic) else v
+                                        for v in values]}
+
+
+def to_msgpack(frames):
+    if msgpack is None:
+        raise SerializeError('msgpack is not installed')
+    out = {}
+    for _, name, df in frames:
+        out[name] = {
+            'columns': [str(c) for c in df.columns],
+            'index': pack_values(df.index),
+            'data': [pack_values(df[c]) for c in df.columns],
+        }
+    return msgpack.packb(out, use_bin_type=True)
+
+
+def encode(frames, fmt='json', sections=None, points=None):
+    if fmt not in FORMATS:
+        raise SerializeError(f'Unknown format: {fmt}')
+    with timing.span('serialize'):
+        frames = downsample(select_sections(frames, sections), points)
+        if fmt == 'msgpack':
+            return to_msgpack(frames)
+        return to_json(frames)
+
+
+def parse_options(args):
+    # ?format=json|msgpack&sections=a,b&points=500 -> encode() kwargs
+    # Validated here, so that bad options are refused before the backtest runs
+    options = {'fmt': args.get('format', 'json')}
+    if options['fmt'] not in FORMATS:
+        raise SerializeError(f"Unknown format: {options['fmt']}")
+    if options['fmt'] == 'msgpack' and msgpack is None:
+        raise SerializeError('msgpack is not installed')
+    if args.get('sections'):
+        options['sections'] = [s.strip() for s in args.get('sections').split(',') if s.strip()]
+    if args.get('points'):
+        if not args.get('points').isnumeric():
+            raise SerializeError('points must be a number')
+        options['points'] = int(args.get('points'))
+    return options
@@ -0,0 +1,207 @@
+import os
+import math
+import numpy as np
+import ffn.utils as utils
+import handleAPI.engine as engine
+import handleAPI.metrics as metrics
+import handleAPI.pricestore as pricestore
+
+# Allocation sweep / efficient frontier.
+#
+# Evaluates many weight vectors over one ticker set and date range: prices
+# are downloaded once, then the weight vectors go through the vectorized
+# engine (the same yearly rebalance as backtester.set_backtest()) in chunks
+# of SWEEP_CHUNK_SIZE columns, so memory stays bounded by
+# days x SWEEP_CHUNK_SIZE no matter how many allocations are requested.
+#
+# Request body:
+#   {"start": "2015-01-01", "end": "2023-01-01",
+#    "tickers": ["VIGRX", "VWEHX", "GC=F"],
+#    "weights": [[0.5, 0.3, 0.2], ...]}            explicit weight vectors
+# or
+#    "grid": {"step": 0.05, "min": [...], "max": [...]}
+#                                                   every long-only vector in
+#                                                   step increments summing to
+#                                                   1 (min/max optional)
+# plus optional "metrics" (keys of metric_info.json, except the dates start
+# and end).
+
+SWEEP_CHUNK_SIZE = int(os.environ.get('SWEEP_CHUNK_SIZE', 500))
+SWEEP_MAX_POINTS = int(os.environ.get('SWEEP_MAX_POINTS', 20000))
+SWEEP_METRICS = ['cagr', 'monthly_vol', 'monthly_sharpe', 'max_drawdown']
+# The frontier maximizes the first metric for a given level of the second
+FRONTIER_AXES = ('cagr', 'monthly_vol')
+
+
+class SweepError(ValueError):
+    pass
+
+
+def grid_units(bounds, n_assets, step, name, default, rounding):
+    # min/max weights -> step units, clamped to [0, 1]
+    units = round(1 / step)
+    if bounds is None:
+        return [default] * n_assets
+    if not isinstance(bounds, (list, tuple)) or len(bounds) != n_assets:
+        raise SweepError(f'grid {name} needs {n_assets} values')
+    try:
+        return [min(max(rounding(round(float(x) / step, 9)), 0), units) for x in bounds]
+    except (TypeError, ValueError, OverflowError):
+        raise SweepError(f'grid {name} must be numbers')
+
+
+def count_grid(units, lower, upper, limit):
+    # Number of vectors with lower <= v <= upper summing to units, counted
+    # asset by asset from the last one; counts are clamped to [0, limit + 1]
+    ways = [1 if lower[-1] <= r <= upper[-1] else 0 for r in range(units + 1)]
+    for lo, hi in zip(reversed(lower[:-1]), reversed(upper[:-1])):
+        prefix = [0]
+        for w in ways:
+            prefix.append(prefix[-1] + w)
+        ways = [min(max(prefix[max(r - lo + 1, 0)] - prefix[max(r - hi, 0)], 0), limit + 1)
+                for r in range(units + 1)]
+    return ways[units]
+
+
+def grid_weights(n_assets, step, lower=None, upper=None, max_points=SWEEP_MAX_POINTS):
+    if not step > 0:
+        raise SweepError('grid step must divide 1')
+    units = round(1 / step)
+    if units <= 0 or not math.isclose(units * step, 1.0):
+        raise SweepError('grid step must divide 1')
+    if units > max_points:
+        raise SweepError('grid step is too small')
+    lower = grid_units(lower, n_assets, step, 'min', 0, math.ceil)
+    upper = grid_units(upper, n_assets, step, 'max', units, math.floor)
+    for i in range(n_assets):
+        if lower[i] > upper[i]:
+            raise SweepError(f'grid min is above max for asset {i + 1} (in steps of {step})')
+    # The grid is counted before it is built, so a bounded grid that is too
+    # large is refused as cheaply as an unbounded one
+    count = count_grid(units, lower, upper, max_points)
+    if count == 0:
+        raise SweepError('grid min/max leave no weights summing to 1')
+    if count > max_points:
+        raise SweepError(f'grid has more than {max_points} points, use a larger step')
+
+    # Sums of the bounds of the assets after i: asset i only takes values
+    # that the remaining assets can complete, so no branch is a dead end
+    lower_rest = [sum(lower[i + 1:]) for i in range(n_assets)]
+    upper_rest = [sum(upper[i + 1:]) for i in range(n_assets)]
+    out = []
+    current = []
+
+    def fill(i, remaining):
+        if i == n_assets:
+            out.append(list(current))
+            return
+        for k in range(max(lower[i], remaining - upper_rest[i]),
+                       min(upper[i], remaining - lower_rest[i]) + 1):
+            current.append(k)
+            fill(i + 1, remaining - k)
+            current.pop()
+
+    fill(0, units)
+    return np.array(out, dtype='float64').reshape(-1, n_assets) * step
+
+
+def parse_weights(req, n_assets, max_points=SWEEP_MAX_POINTS):
+    if req.get('weights') is not None:
+        try:
+            weights = np.array(req['weights'], dtype='float64')
+        except (TypeError, ValueError):
+            raise SweepError('weights must be a list of number lists')
+        if weights.ndim != 2 or weights.shape[1] != n_assets:
+            raise SweepError(f'every weight vector needs {n_assets} values')
+        if len(weights) > max_points:
+            raise SweepError(f'at most {max_points} weight vectors per sweep')
+        if not np.isfinite(weights).all() or (weights < 0).any():
+            raise SweepError('weights must be finite non-negative numbers')
+        if not weights.any(axis=1).all():
+            raise SweepError('every weight vector needs a non-zero weight')
+        return weights
+    if req.get('grid') is not None:
+        grid = req['grid']
+        try:
+            step = float(grid.get('step', 0.1))
+        except (TypeError, ValueError):
+            raise SweepError('grid step must be a number')
+        return grid_weights(n_assets, step, grid.get('min'), grid.get('max'), max_points)
+    raise SweepError('weights or grid is required')
+
+
+def efficient_frontier(returns, risks):
+    # Indices of the points with the highest return for their risk, sorted
+    # by risk: walking up in risk, keep a point only if it beats every
+    # less risky one
+    valid = np.flatnonzero(np.isfinite(returns) & np.isfinite(risks))
+    order = valid[np.lexsort((-returns[valid], risks[valid]))]
+    frontier = []
+    best = -np.inf
+    for i in order:
+        if returns[i] > best:
+            frontier.append(int(i))
+            best = returns[i]
+    return frontier
+
+
+def run_sweep(prices, weights, metric_registry, metric_keys=None, rf=0.01,
+              chunk_size=SWEEP_CHUNK_SIZE, initial_capital=1000000.0):
+    # prices: (days x assets) DataFrame, weights: (points x assets)
+    # Returns {metric: ndarray(points)}
+    if metric_keys is None:
+        metric_keys = SWEEP_METRICS
+    rebalance_mask = engine.yearly_rebalance_mask(prices.index)
+    results = {m: np.empty(len(weights)) for m in metric_keys}
+    for start in range(0, len(weights), chunk_size):
+        chunk = weights[start:start + chunk_size]
+        values = engine.run_weights(prices.values, chunk.T,
+                                    initial_capital=initial_capital,
+                                    rebalance_mask=rebalance_mask)
+        names = list(range(start, start + len(chunk)))
+        context = metrics.MetricContext(engine.strategy_prices(prices.index, values, names, initial_capital), rf=rf)
+        df = metric_registry.compute(context, metric_keys)
+        for m in metric_keys:
+            results[m][start:start + len(chunk)] = df.loc[m].values.astype('float64')
+    return results
+
+
+def to_list(values):
+    # NaN and infinities are not valid JSON
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+
+def sweep(req, metric_registry, source=None):
+    if source is None:
+        source = pricestore.get_source()
+    tickers = req.get('tickers') or []
+    if not tickers:
+        raise SweepError('tickers is required')
+    if len(set(utils.clean_ticker(t) for t in tickers)) != len(tickers):
+        raise SweepError('tickers must be unique')
+    metric_keys = req.get('metrics') or SWEEP_METRICS
+    unknown = [m for m in metric_keys if m not in metric_registry.metrics]
+    if unknown:
+        raise SweepError(f'Unknown metrics: {", ".join(unknown)}')
+    dates = [m for m in metric_keys if m in metrics.DATE_METRICS]
+    if dates:
+        raise SweepError(f'Only numeric metrics can be swept, not: {", ".join(dates)}')
+    weights = parse_weights(req, len(tickers))
+
+    prices = pricestore.get_prices(tickers, start=req.get('start'), end=req.get('end'), source=source)
+    if len(prices) < 2:
+        raise SweepError('not enough price data for these tickers and dates')
+    results = run_sweep(prices, weights, metric_registry, metric_keys)
+
+    out = {
+        'tickers': tickers,
+        'start': prices.index[0].isoformat(),
+        'end': prices.index[-1].isoformat(),
+        'weights': weights.tolist(),
+        'results': {m: to_list(v) for m, v in results.items()},
+        'frontier': [],
+    }
+    y_axis, x_axis = FRONTIER_AXES
+    if y_axis in results and x_axis in results:
+        out['frontier'] = efficient_frontier(results[y_axis], results[x_axis])
+    return out
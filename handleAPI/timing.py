@@ -0,0 +1,139 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Per-stage timing for backtests.
+#
+# Code marks its stages with
+#   with timing.span('download'):
+#       ...
+# Spans are summed per stage into the Spans collector opened by the
+# innermost timing.collect() on the current thread. When the outermost
+# collector closes, its totals are observed once per stage into the
+# stage_seconds histograms served on /metrics. A span outside of any
+# collector is observed on its own.
+#
+# Backtest jobs run in pool workers (see handleAPI/jobs.py), whose
+# histograms are not the server's: workers return their span totals with
+# the result and the JobManager observes them in the server process.
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class StageHistograms:
+    # One Histogram per stage, rendered as a single Prometheus histogram
+    # metric with a 'stage' label
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self._histograms:
+                self._histograms[stage] = Histogram(self.buckets)
+            self._histograms[stage].observe(seconds)
+
+    def observe_spans(self, items):
+        for stage, seconds in items:
+            self.observe(stage, seconds)
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            for stage, histogram in self._histograms.items():
+                cumulative = 0
+                for le, count in zip([*map(repr, histogram.buckets), '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+stage_seconds = StageHistograms('backtest_stage_seconds', 'Time spent in each backtest stage.')
+
+
+class Spans:
+    # Seconds per stage for one request, in first-seen order
+
+    def __init__(self):
+        self._totals = {}
+
+    def add(self, stage, seconds):
+        self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+
+    def extend(self, items):
+        for stage, seconds in items:
+            self.add(stage, seconds)
+
+    def items(self):
+        return list(self._totals.items())
+
+    def total(self):
+        return sum(self._totals.values())
+
+
+def server_timing(items):
+    # Server-Timing header value, durations in milliseconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in items)
+
+
+_local = threading.local()
+
+
+def _current():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def collect():
+    if getattr(_local, 'stack', None) is None:
+        _local.stack = []
+    spans = Spans()
+    _local.stack.append(spans)
+    try:
+        yield spans
+    finally:
+        _local.stack.pop()
+        outer = _current()
+        if outer is not None:
+            outer.extend(spans.items())
+        else:
+            stage_seconds.observe_spans(spans.items())
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        spans = _current()
+        if spans is not None:
+            spans.add(stage, seconds)
+        else:
+            stage_seconds.observe(stage, seconds)
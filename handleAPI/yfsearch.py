@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from concurrent.futures import Future
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+import handleAPI.cache as cache
+
+# Proxy for Yahoo Finance's search assist, behind /api/yahoos_finance_stocks.
+#
+# The UI searches on every keystroke, so instead of one new connection per
+# request the proxy
+#   - keeps one pooled requests.Session with strict connect / read timeouts
+#   - caches results in an LRU with a TTL, keyed on the normalized query
+#   - coalesces concurrent identical queries into a single upstream call
+#   - falls back to the local symbol index (simpleStockList.json) when Yahoo
+#     is slow, unreachable or returns something unexpected; fallback results
+#     are only cached for YF_FALLBACK_TTL so Yahoo is retried soon
+# YF_SEARCH_URL can point to a local stub server for testing.
+
+YF_SEARCH_URL = os.environ.get(
+    'YF_SEARCH_URL',
+    'https://finance.yahoo.com/_finance_doubledown/api/resource/searchassist;searchTerm={query}')
+YF_CONNECT_TIMEOUT = float(os.environ.get('YF_CONNECT_TIMEOUT', 1.0))
+YF_READ_TIMEOUT = float(os.environ.get('YF_READ_TIMEOUT', 2.0))
+YF_POOL_SIZE = int(os.environ.get('YF_POOL_SIZE', 10))
+YF_CACHE_SIZE = int(os.environ.get('YF_CACHE_SIZE', 4096))
+YF_CACHE_TTL = int(os.environ.get('YF_CACHE_TTL', 3600))
+YF_FALLBACK_TTL = int(os.environ.get('YF_FALLBACK_TTL', 30))
+YF_FALLBACK_LIMIT = int(os.environ.get('YF_FALLBACK_LIMIT', 10))
+
+HEADERS = {
+    'user-agent':
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36'
+}
+
+
+def normalize(query):
+    return ' '.join(str(query).lower().split())
+
+
+def to_symbol_name(item):
+    return {'symbol': item['symbol'], 'name': item['name']}
+
+
+class YahooSearchProxy:
+
+    def __init__(self, fallback_index=None, url=YF_SEARCH_URL,
+                 timeout=(YF_CONNECT_TIMEOUT, YF_READ_TIMEOUT), pool_size=YF_POOL_SIZE,
+                 cache_size=YF_CACHE_SIZE, ttl=YF_CACHE_TTL, fallback_ttl=YF_FALLBACK_TTL,
+                 fallback_limit=YF_FALLBACK_LIMIT):
+        self.fallback_index = fallback_index
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.fallback_limit = fallback_limit
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.cache = cache.ResultCache(max_entries=cache_size, spill_dir=None)
+        self._in_flight = {}    # normalized query -> Future
+        self._lock = threading.Lock()
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+
+    def fetch(self, query):
+        # Upstream call, returns [{'symbol', 'name'}, ...]
+        with self._lock:
+            self.upstream_calls += 1
+        res = self.session.get(self.url.format(query=quote(query, safe='')), timeout=self.timeout)
+        res.raise_for_status()
+        return list(map(to_symbol_name, res.json()['items']))
+
+    def fallback(self, query):
+        if self.fallback_index is None:
+            return []
+        return [to_symbol_name(r) for r in self.fallback_index.search(query, limit=self.fallback_limit)]
+
+    def _search(self, query):
+        # {'results', 'message', 'source'}; never raises for upstream errors
+        try:
+            results = self.fetch(query)
+            data = {'results': results, 'message': '', 'source': 'yahoo'}
+            self.cache.put(query, data, time.time() + self.ttl)
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            print(f'ERROR : {e}')
+            with self._lock:
+                self.fallbacks += 1
+            data = {'results': self.fallback(query), 'message': '', 'source': 'local'}
+            self.cache.put(query, data, time.time() + self.fallback_ttl)
+        return data
+
+    def search(self, query):
+        query = normalize(query)
+        if not query:
+            return {'results': [], 'message': '', 'source': 'local'}
+        data = self.cache.get(query)
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self._in_flight.get(query)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[query] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            data = self._search(query)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[query]
@@ -1,9 +1,15 @@
 from flask import Flask, Response, request
-import requests
 # import os
 # import sys
 import json
+import threading
 import handleAPI.backtester as hBt
+import handleAPI.jobs as hJobs
+import handleAPI.serialize as hSerialize
+import handleAPI.sweep as hSweep
+import handleAPI.timing as hTiming
+import handleAPI.yfsearch as hYfSearch
+from handleAPI.search import SymbolIndex
 
 from flask_cors import CORS
 
@@ -12,8 +18,44 @@ app = Flask('app')
 CORS(app)
 # CORS(app, resources={r"/.*": {"origins": ["*"]}})
 
-with open('./StockData/simpleStockList.json', newline='') as jsonfile:
-    Ticker = json.load(jsonfile)
+
+def once(build):
+    # Server state is built on first use, not at import: the backtest
+    # workers are spawned and re-import this module as __mp_main__, and
+    # must not build search indexes, sessions or a job manager
+    lock = threading.Lock()
+    built = []
+
+    def get():
+        with lock:
+            if not built:
+                built.append(build())
+            return built[0]
+    return get
+
+
+# Search indexes, see handleAPI/search.py
+@once
+def ticker_index():
+    with open('./StockData/simpleStockList.json', newline='') as jsonfile:
+        return SymbolIndex(json.load(jsonfile))
+
+
+@once
+def all_stock_index():
+    return SymbolIndex.from_all_stock('./StockData/allStock.json')
+
+
+# Yahoo search proxy, falling back to the local index, see handleAPI/yfsearch.py
+@once
+def yf_search():
+    return hYfSearch.YahooSearchProxy(ticker_index())
+
+
+# Backtests run in a process pool, see handleAPI/jobs.py
+@once
+def jobs():
+    return hJobs.JobManager(hBt.result_cache)
 
 
 @app.route('/')
@@ -23,37 +65,181 @@ def hello_world():
                     status=200)
 
 
+def options_error(e):
+    return Response(json.dumps({'message': f'ERROR : {e}'}),
+                    mimetype='application/json',
+                    status=400)
+
+
+# Encodes a backtest result according to the options parsed from the query
+# string, see hSerialize.parse_options():
+# ?format=json|msgpack&sections=port_perf_chart,...&points=500
+def backtest_response(frames, options, status=200):
+    try:
+        body = hSerialize.encode(frames, **options)
+    except hSerialize.SerializeError as e:
+        return options_error(e)
+    return Response(body,
+                    mimetype=hSerialize.FORMATS[options['fmt']],
+                    status=status)
+
+
+# Backtest response with its stage timings, adding a Server-Timing header
+# when the query string has ?timing=1
+def timed_backtest_response(job, options):
+    with hTiming.collect() as spans:
+        response = backtest_response(job.result(), options)
+    if request.args.get('timing'):
+        response.headers['Server-Timing'] = hTiming.server_timing(job.spans() + spans.items())
+    return response
+
+
 # Portfolios API
+# Synchronous wrapper over the job tier: same workers, dedup and cache
 @app.route('/api/portfolios', methods=['POST'])
 def portfoliosAPI():
     req = request.json
-    data = hBt.run_backtest(start=req[0], end=req[1], portfolios=req[2])
+    try:
+        options = hSerialize.parse_options(request.args)
+    except hSerialize.SerializeError as e:
+        return options_error(e)
+    try:
+        job = jobs().submit(start=req[0], end=req[1], portfolios=req[2])
+        jobs().wait(job)
+    except hJobs.QueueFull as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=429)
+    except TimeoutError as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=504)
 
     print('Portfolios Backtest Completed!')
+    return timed_backtest_response(job, options)
+
+
+# Backtest Jobs API
+@app.route('/api/jobs', methods=['POST'])
+def submitJobAPI():
+    req = request.json
+    try:
+        job = jobs().submit(start=req[0], end=req[1], portfolios=req[2])
+    except hJobs.QueueFull as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=429)
+    return Response(json.dumps(job.info()),
+                    mimetype='application/json',
+                    status=202)
+
+
+@app.route('/api/jobs/<job_id>')
+def jobStatusAPI(job_id):
+    job = jobs().get(job_id)
+    if job is None:
+        return Response(json.dumps({'message': 'Job not found'}),
+                        mimetype='application/json',
+                        status=404)
+    return Response(json.dumps(job.info()),
+                    mimetype='application/json',
+                    status=200)
+
+
+@app.route('/api/jobs/<job_id>/result')
+def jobResultAPI(job_id):
+    job = jobs().get(job_id)
+    if job is None:
+        return Response(json.dumps({'message': 'Job not found'}),
+                        mimetype='application/json',
+                        status=404)
+    status = job.status
+    if status == hJobs.DONE:
+        try:
+            options = hSerialize.parse_options(request.args)
+        except hSerialize.SerializeError as e:
+            return options_error(e)
+        return timed_backtest_response(job, options)
+    elif status == hJobs.TIMEOUT:
+        return Response(json.dumps(job.info()),
+                        mimetype='application/json',
+                        status=504)
+    elif status == hJobs.FAILED:
+        return Response(json.dumps(job.info()),
+                        mimetype='application/json',
+                        status=500)
+    return Response(json.dumps(job.info()),
+                    mimetype='application/json',
+                    status=202)
+
+
+# Allocation sweep / efficient frontier API, see handleAPI/sweep.py
+@app.route('/api/sweep', methods=['POST'])
+def sweepAPI():
+    req = request.json
+    try:
+        data = jobs().wait(jobs().submit_sweep(req))
+    except hJobs.QueueFull as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=429)
+    except TimeoutError as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=504)
+    except hSweep.SweepError as e:
+        return Response(json.dumps({'message': f'ERROR : {e}'}),
+                        mimetype='application/json',
+                        status=400)
+
+    print('Allocation Sweep Completed!')
     return Response(json.dumps(data), mimetype='application/json', status=200)
 
 
-# Fond keywords
-def filter_list(func, iterable):
-    new_iterable = filter(func, iterable)
-    return list(new_iterable)
+# Backtest stage timing histograms, in Prometheus text format
+@app.route('/metrics')
+def metricsAPI():
+    return Response(hTiming.stage_seconds.render(),
+                    mimetype='text/plain; version=0.0.4',
+                    status=200)
+
+
+# Backtest result cache hit/miss counters
+@app.route('/api/cache/stats')
+def cacheStatsAPI():
+    return Response(json.dumps(hBt.result_cache.stats()),
+                    mimetype='application/json',
+                    status=200)
 
 
 # Search Symbol API
+def parse_filters(args):
+    # Optional ?sector=&min_cap=&max_cap= filters, served from allStock.json
+    filters = {}
+    if args.get('sector'):
+        filters['sector'] = args.get('sector')
+    if args.get('min_cap'):
+        filters['min_market_cap'] = float(args.get('min_cap'))
+    if args.get('max_cap'):
+        filters['max_market_cap'] = float(args.get('max_cap'))
+    return filters
+
+
+def search_symbols(search, limit=0):
+    filters = parse_filters(request.args)
+    index = all_stock_index() if filters else ticker_index()
+    return index.search(search, limit=limit, **filters)
+
+
 @app.route('/api/keyword/<search>')
 def searchAPI(search):
     # print("--------/keyword-----------"+search)
-    search = search.lower().rstrip().lstrip()
-
-    def search_even(x):
-        s = json.dumps(x["symbol"]).lower().find(search)
-        n = json.dumps(x["name"]).lower().find(search)
-        if s != -1 or n != -1:
-            return True
-        return False
-
-    search_list = filter_list(search_even, Ticker)
-    print(search_list)
+    try:
+        search_list = search_symbols(search)
+    except ValueError:
+        return Response(json.dumps([]),
+                        mimetype='application/json',
+                        status=400)
     return Response(json.dumps(search_list),
                     mimetype='application/json',
                     status=200)
@@ -65,24 +251,18 @@ def limitSearchAPI(search, max):
     print("--------/keyword-with-Limit-applied-----------" +
           search + "---limit:" + max)
 
-    def search_even(x):
-        s = json.dumps(x['symbol']).lower().find(search)
-        n = json.dumps(x['name']).lower().find(search)
-        if s != -1 or n != -1:
-            return True
-        return False
-
     if max.isnumeric():
-        search = search.lower().rstrip().lstrip()
-        maxResults = int(max)
-        g = filter_list(search_even, Ticker)
-        if maxResults > len(g) | maxResults == 0:
-            maxResults = len(g)
-        count = 0
-        limited_list = []
-        while count < maxResults and count < len(g):
-            limited_list.append(g[count])
-            count += 1
+        # The search stops once it has found maxResults matches;
+        # 0 means no limit
+        try:
+            limited_list = search_symbols(search, int(max))
+        except ValueError:
+            return Response(json.dumps({
+                'results': [],
+                'message': 'Market cap filters must be numbers'
+            }),
+                mimetype='application/json',
+                status=400)
         return Response(json.dumps({
             'results': limited_list,
             'message': ''
@@ -102,44 +282,17 @@ def limitSearchAPI(search, max):
 @app.route('/api/yahoos_finance_stocks/<query>')
 def searchYfStocksAPI(query):
     print("--------/stocks-----------" + query)
-    query = query.lower().rstrip().lstrip()
-
-    url = f'https://finance.yahoo.com/_finance_doubledown/api/resource/searchassist;searchTerm={query}'
-    headers = {
-        'user-agent':
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36'
-    }
-
-    try:
-        res = requests.get(url, headers=headers)
-        res.raise_for_status()
-        res_stocks = res.json()
-
-        def toSymbol_Name(x):
-            return {'symbol': x['symbol'], 'name': x['name']}
-
-        stocks_list = list(map(toSymbol_Name, res_stocks['items']))
-        # print(stocks_list)
-        return Response(json.dumps({
-            'results': stocks_list,
-            'message': ''
-        }),
-            mimetype='application/json',
-            status=res.status_code)
-
-    except requests.exceptions.RequestException as e:
-        print(f'ERROR : {e}')
-        return Response(json.dumps({
-            'results': [],
-            'message': f'ERROR : {e}'
-        }),
-            mimetype='application/json',
-            status=res.status_code)
-
+    return Response(json.dumps(yf_search().search(query)),
+                    mimetype='application/json',
+                    status=200)
 
-print("Server is running...")
 
 if __name__ == '__main__':
+    # Backtest workers re-import this module, so only the server process
+    # gets past this point. The indexes are built before the first request.
+    ticker_index()
+    all_stock_index()
+    print("Server is running...")
     from waitress import serve
     serve(app, host='0.0.0.0', port=8080)
 
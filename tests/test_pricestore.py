@@ -0,0 +1,121 @@
+import os
+import time
+import tempfile
+import unittest
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import handleAPI.pricestore as pricestore
+
+
+class StubSource:
+    # Upstream returning slices of a fixed series; records every request and
+    # returns nothing while `down` is set, like a throttled Yahoo
+
+    def __init__(self, series):
+        self.series = series
+        self.down = False
+        self.requests = []
+
+    def fetch(self, ticker, start, end):
+        self.requests.append((pd.Timestamp(start), pd.Timestamp(end)))
+        if self.down:
+            return pricestore.empty_series()
+        return pricestore.slice_range(self.series, start, end)
+
+
+class SlowSource(StubSource):
+
+    def fetch(self, ticker, start, end):
+        time.sleep(0.5)
+        return super().fetch(ticker, start, end)
+
+
+def make_series(start='2005-01-01', end='2014-01-01'):
+    dates = pd.bdate_range(start, end)
+    return pd.Series(100.0 + np.arange(len(dates)) * 0.1, index=dates)
+
+
+def fetch_in_worker(path, start, end):
+    store = pricestore.PriceStore(SlowSource(make_series()), path=path)
+    return len(store.fetch('SPY', start, end))
+
+
+class PriceStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.upstream = StubSource(make_series())
+        self.store = pricestore.PriceStore(self.upstream, path=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def expected(self, start, end):
+        return pricestore.slice_range(self.upstream.series, start, end)
+
+    def test_merges_head_and_tail(self):
+        self.store.fetch('SPY', '2010-01-01', '2012-01-01')
+        series = self.store.fetch('SPY', '2008-01-01', '2013-01-01')
+        pd.testing.assert_series_equal(series, self.expected('2008-01-01', '2013-01-01'), check_freq=False)
+        # Covered ranges are served from disk
+        requests = len(self.upstream.requests)
+        series = self.store.fetch('SPY', '2009-01-01', '2012-06-01')
+        self.assertEqual(len(self.upstream.requests), requests)
+        pd.testing.assert_series_equal(series, self.expected('2009-01-01', '2012-06-01'), check_freq=False)
+
+    def test_files_keyed_by_symbol(self):
+        self.store.fetch('GC=F', '2010-01-01', '2011-01-01')
+        self.store.fetch('BW^A', '2010-01-01', '2011-01-01')
+        self.store.fetch('BWA', '2010-01-01', '2011-01-01')
+        self.assertEqual(sorted(f for f in os.listdir(self.tmp.name) if f.endswith('.npy')),
+                         ['BW%5EA.npy', 'BWA.npy', 'GC%3DF.npy'])
+
+    def test_rebases_stored_history(self):
+        self.store.fetch('SPY', '2010-01-01', '2011-01-01')
+        # A dividend after the stored range back-adjusts all earlier prices
+        series = make_series()
+        series[series.index < '2011-06-01'] *= 0.99
+        self.upstream.series = series
+        stored = self.store.fetch('SPY', '2010-01-01', '2012-01-01')
+        returns = stored / stored.shift(1) - 1
+        expected = self.expected('2010-01-01', '2012-01-01')
+        np.testing.assert_allclose(returns.values[1:], (expected / expected.shift(1) - 1).values[1:], rtol=1e-12)
+        self.assertAlmostEqual(stored.iloc[0], expected.iloc[0], places=9)
+
+    def test_throttled_first_download_is_not_covered(self):
+        self.upstream.down = True
+        self.assertTrue(self.store.fetch('SPY', '2010-01-01', '2011-01-01').empty)
+        self.assertEqual([f for f in os.listdir(self.tmp.name) if not f.endswith('.lock')], [])
+        self.upstream.down = False
+        series = self.store.fetch('SPY', '2010-01-01', '2011-01-01')
+        pd.testing.assert_series_equal(series, self.expected('2010-01-01', '2011-01-01'), check_freq=False)
+
+    def test_throttled_extension_raises(self):
+        self.store.fetch('SPY', '2010-01-01', '2012-01-01')
+        self.upstream.down = True
+        with self.assertRaises(pricestore.DownloadError):
+            self.store.fetch('SPY', '2005-01-01', '2012-01-01')
+        # Nothing was marked covered: the range is requested again
+        self.upstream.down = False
+        series = self.store.fetch('SPY', '2005-01-01', '2012-01-01')
+        pd.testing.assert_series_equal(series, self.expected('2005-01-01', '2012-01-01'), check_freq=False)
+
+    def test_concurrent_extensions_from_processes(self):
+        # Backtest workers are processes with their own PriceStore: both
+        # extensions must end up on disk, with data for all of the coverage
+        self.store.fetch('SPY', '2010-01-01', '2011-01-01')
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(2, mp_context=context) as pool:
+            head = pool.submit(fetch_in_worker, self.tmp.name, '2008-01-01', '2011-01-01')
+            tail = pool.submit(fetch_in_worker, self.tmp.name, '2010-01-01', '2013-01-01')
+            self.assertEqual(head.result(), len(self.expected('2008-01-01', '2011-01-01')))
+            self.assertEqual(tail.result(), len(self.expected('2010-01-01', '2013-01-01')))
+        self.upstream.down = True
+        series = pricestore.PriceStore(self.upstream, path=self.tmp.name).fetch('SPY', '2008-01-01', '2013-01-01')
+        pd.testing.assert_series_equal(series, self.expected('2008-01-01', '2013-01-01'), check_freq=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
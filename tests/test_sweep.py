@@ -0,0 +1,96 @@
+import math
+import time
+import json
+import itertools
+import unittest
+import numpy as np
+import handleAPI.metrics as metrics
+import handleAPI.sweep as sweep
+
+
+def brute_force_grid(n_assets, units, lower, upper):
+    return sorted(v for v in itertools.product(range(units + 1), repeat=n_assets)
+                  if sum(v) == units and all(lo <= x <= hi for x, lo, hi in zip(v, lower, upper)))
+
+
+class GridTest(unittest.TestCase):
+
+    def test_count_matches_enumeration(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            n_assets = int(rng.integers(1, 5))
+            units = int(rng.integers(1, 9))
+            lower = [int(x) for x in rng.integers(0, units + 1, n_assets)]
+            upper = [int(x) for x in rng.integers(0, units + 1, n_assets)]
+            expected = brute_force_grid(n_assets, units, lower, upper)
+            self.assertEqual(sweep.count_grid(units, lower, upper, 10 ** 6), len(expected))
+
+    def test_count_is_never_negative(self):
+        self.assertEqual(sweep.count_grid(2, [2, 0, 0], [0, 2, 2], 100), 0)
+
+    def test_grid_weights(self):
+        step = 0.25
+        weights = sweep.grid_weights(3, step, lower=[0.25, 0, 0], upper=[1, 0.5, 1])
+        units = [tuple(int(x) for x in row) for row in np.rint(weights / step)]
+        self.assertEqual(sorted(units), brute_force_grid(3, 4, [1, 0, 0], [4, 2, 4]))
+        np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+        self.assertEqual(len(sweep.grid_weights(3, 0.05)), math.comb(22, 2))
+
+    def test_bounded_grid_is_pruned(self):
+        # Used to enumerate for minutes before the size check
+        started = time.time()
+        with self.assertRaises(sweep.SweepError):
+            sweep.grid_weights(12, 0.01, lower=[0] * 11 + [0.9])
+        self.assertEqual(len(sweep.grid_weights(12, 0.05, lower=[0] * 11 + [0.9])), math.comb(13, 11))
+        self.assertLess(time.time() - started, 5)
+
+    def test_invalid_grids(self):
+        for kwargs in [dict(step=0.3), dict(step=0), dict(step=-0.1), dict(step=1e-9),
+                       dict(step=0.1, lower=[0.1]), dict(step=0.1, upper=[1] * 4),
+                       dict(step=0.1, lower=['x'] * 3), dict(step=0.1, lower=[0.5] * 3),
+                       dict(step=0.5, lower=[0.6, 0, 0], upper=[0.4, 1, 1])]:
+            with self.assertRaises(sweep.SweepError, msg=kwargs):
+                sweep.grid_weights(3, **kwargs)
+
+
+class ParseWeightsTest(unittest.TestCase):
+
+    def test_weights(self):
+        weights = sweep.parse_weights({'weights': [[0.5, 0.5], [1, 0]]}, 2)
+        np.testing.assert_array_equal(weights, [[0.5, 0.5], [1.0, 0.0]])
+
+    def test_invalid_weights(self):
+        for weights in [[[0.5]], [[-0.5, 1.5]], [[float('nan'), 1]], [[float('inf'), 0]],
+                        [[1, 0], [0, 0]], [['a', 'b']]]:
+            with self.assertRaises(sweep.SweepError, msg=weights):
+                sweep.parse_weights({'weights': weights}, 2)
+
+    def test_to_list_drops_non_finite(self):
+        self.assertEqual(sweep.to_list(np.array([0.5, np.nan, np.inf, -np.inf])), [0.5, None, None, None])
+
+    def test_frontier_skips_non_finite(self):
+        returns = np.array([0.05, 0.08, np.inf, 0.07, np.nan])
+        risks = np.array([0.10, 0.20, 0.15, 0.30, 0.05])
+        self.assertEqual(sweep.efficient_frontier(returns, risks), [0, 1])
+
+
+class NoSource:
+
+    def fetch(self, ticker, start, end):
+        raise AssertionError('requests are validated before downloading')
+
+
+class SweepRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        with open('data/metric_info.json', encoding='utf8') as f:
+            self.registry = metrics.MetricRegistry(json.load(f), {})
+
+    def test_only_numeric_metrics(self):
+        for keys in [['start'], ['start', 'cagr'], ['end'], ['no_such_metric']]:
+            with self.assertRaises(sweep.SweepError, msg=keys):
+                sweep.sweep({'tickers': ['SPY'], 'weights': [[1]], 'metrics': keys}, self.registry, NoSource())
+
+
+if __name__ == '__main__':
+    unittest.main()